@@ -1,68 +1,265 @@
+import json
+import os
 import requests
 import pandas as pd
 import boto3
+import pyarrow as pa
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from io import StringIO
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 
+from s3_delta import write_delta
+
 # -------------------------
 # 🔧 Configuration
 # -------------------------
-URL = "https://data.rennesmetropole.fr/api/records/1.0/search/?dataset=etat-du-trafic-en-temps-reel&rows=100"
+URL = "https://data.rennesmetropole.fr/api/records/1.0/search/"
+DATASET = "etat-du-trafic-en-temps-reel"
+PAGE_ROWS = 100                  # 🔹 taille d'une page de l'API
+MAX_OFFSET = 10_000              # 🔹 limite start + rows de l'API v1
+MAX_CONCURRENCY = 8              # 🔹 pages récupérées en parallèle
+REQUEST_TIMEOUT = 10
 BUCKET_NAME = "cityflow-raw0"
 S3_FOLDER = "etat-trafic/"  # 🔹 le dossier cible sur S3
+OUTPUT_FORMAT = "parquet"    # 🔹 "parquet", "csv.gz" ou "csv"
+
+# Types explicites des mesures (les autres colonnes sont inférées)
+TRAFFIC_SCHEMA = pa.schema([
+    ("vitesse_maxi", pa.float64()),
+    ("traveltime", pa.float64()),
+    ("averagevehiclespeed", pa.float64()),
+    ("vehicleprobemeasurement", pa.float64()),
+    ("id_rva_troncon_fcd_v1_1", pa.float64()),
+])
+
+# Déduplication : mémoire bornée + checkpoint disque rechargé au démarrage
+DEDUP_STATE_FILE = "dedup_state.json"
+DEDUP_MAX_IDS = 200_000          # 🔹 nombre max de recordid gardés (LRU)
+DEDUP_TTL_SECONDS = 6 * 3600     # 🔹 un recordid est oublié après ce délai
+
+
+class DedupCache:
+    """Ensemble de recordid borné en taille (LRU) et en âge (TTL), persistable sur disque."""
+
+    def __init__(self, max_ids=DEDUP_MAX_IDS, ttl_seconds=DEDUP_TTL_SECONDS, path=DEDUP_STATE_FILE):
+        self.max_ids = max_ids
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self._seen = OrderedDict()  # recordid -> timestamp du dernier passage
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __contains__(self, record_id):
+        seen_at = self._seen.get(record_id)
+        if seen_at is None:
+            return False
+        if time.time() - seen_at > self.ttl_seconds:
+            del self._seen[record_id]
+            return False
+        return True
+
+    def add(self, record_id):
+        self._seen[record_id] = time.time()
+        self._seen.move_to_end(record_id)
+        self._evict()
+
+    def _evict(self):
+        expiry = time.time() - self.ttl_seconds
+        while self._seen:
+            oldest_id, seen_at = next(iter(self._seen.items()))
+            if len(self._seen) <= self.max_ids and seen_at >= expiry:
+                break
+            del self._seen[oldest_id]
+
+    def load(self):
+        """Recharge le checkpoint disque (les entrées expirées sont ignorées)."""
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path, encoding="utf-8") as f:
+            entries = json.load(f)
+        for record_id, seen_at in sorted(entries.items(), key=lambda kv: kv[1]):
+            self._seen[record_id] = seen_at
+        self._evict()
+        print(f"🔁 {len(self._seen)} recordid rechargés depuis {self.path}")
+        return self
+
+    def checkpoint(self):
+        """Écrit l'état sur disque de façon atomique."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._seen, f)
+        os.replace(tmp_path, self.path)
+
+
+# Micro-batch : un objet S3 par lot (taille, nb de lignes ou durée atteinte)
+FLUSH_MAX_ROWS = 50_000
+FLUSH_MAX_BYTES = 32 * 1024 * 1024
+FLUSH_MAX_SECONDS = 15 * 60
+WAL_FILE = "poller_wal.jsonl"    # 🔹 journal local des records en attente d'upload
+
+
+class RollingWriter:
+    """Accumule les records et écrit un seul objet S3 par lot.
+
+    Chaque record est d'abord ajouté au journal local (WAL) : après un crash, les
+    records non encore envoyés sont rechargés au démarrage puis envoyés au flush suivant.
+    """
+
+    def __init__(self, s3_client, dedup, wal_path=WAL_FILE):
+        self.s3 = s3_client
+        self.dedup = dedup
+        self.wal_path = wal_path
+        self.records = []
+        self.size_bytes = 0
+        self.opened_at = None
+
+    def replay(self):
+        """Recharge les records du WAL laissés par une exécution précédente."""
+        if not os.path.exists(self.wal_path):
+            return self
+        with open(self.wal_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._buffer(entry["record"], entry["received_at"], len(line))
+                self.dedup.add(entry["record"].get("recordid"))
+        if self.records:
+            print(f"🔁 {len(self.records)} records rechargés depuis {self.wal_path}")
+        return self
+
+    def _buffer(self, record, received_at, size):
+        if self.opened_at is None:
+            self.opened_at = datetime.fromisoformat(received_at)
+        self.records.append(record)
+        self.size_bytes += size
+
+    def append(self, records):
+        now = datetime.now().isoformat()
+        with open(self.wal_path, "a", encoding="utf-8") as wal:
+            for record in records:
+                line = json.dumps({"received_at": now, "record": record}, ensure_ascii=False) + "\n"
+                wal.write(line)
+                self._buffer(record, now, len(line))
+            wal.flush()
+            os.fsync(wal.fileno())
+
+    def should_flush(self, now=None):
+        if not self.records:
+            return False
+        now = now or datetime.now()
+        return (
+            len(self.records) >= FLUSH_MAX_ROWS
+            or self.size_bytes >= FLUSH_MAX_BYTES
+            or (now - self.opened_at).total_seconds() >= FLUSH_MAX_SECONDS
+            or now.date() != self.opened_at.date()  # un lot ne chevauche jamais deux jours
+        )
+
+    def flush(self):
+        """Écrit le lot courant sur S3, puis vide le WAL et checkpoint la déduplication."""
+        if not self.records:
+            return None
+        start = self.opened_at
+        key_base = f"{S3_FOLDER}{start.year}/{start.month:02d}/{start.day:02d}/{start.strftime('%H%M%S')}"
+        s3_key = write_delta(pd.DataFrame(self.records), BUCKET_NAME, key_base, fmt=OUTPUT_FORMAT,
+                             schema=TRAFFIC_SCHEMA, s3=self.s3)
+        print(f"[{datetime.now()}] ☁️  Lot de {len(self.records)} records uploadé : s3://{BUCKET_NAME}/{s3_key}")
+
+        self.records = []
+        self.size_bytes = 0
+        self.opened_at = None
+        open(self.wal_path, "w").close()
+        self.dedup.checkpoint()
+        return s3_key
+
+
+def make_session():
+    """Session keep-alive partagée, avec retry/backoff sur les erreurs transitoires."""
+    retry = Retry(total=4, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_page(session, start):
+    response = session.get(URL, params={"dataset": DATASET, "rows": PAGE_ROWS, "start": start},
+                           timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_snapshot(session, executor, expected_hits=0):
+    """Récupère toutes les pages d'un instantané du réseau.
+
+    Les pages attendues (d'après le nhits du tick précédent) partent en parallèle dès
+    le départ ; si le nombre de résultats a augmenté, les pages manquantes suivent.
+    Renvoie (records, nhits).
+    """
+    def starts_for(nhits, already=0):
+        return list(range(already, min(max(nhits, 1), MAX_OFFSET), PAGE_ROWS))
+
+    starts = starts_for(expected_hits)
+    pages = list(executor.map(lambda start: fetch_page(session, start), starts))
+    nhits = pages[0].get("nhits", 0)
+
+    missing = starts_for(nhits, already=starts[-1] + PAGE_ROWS)
+    if missing:
+        pages += list(executor.map(lambda start: fetch_page(session, start), missing))
+
+    if nhits > MAX_OFFSET:
+        print(f"⚠️ {nhits} résultats : seuls les {MAX_OFFSET} premiers sont accessibles via l'API v1")
+    records = [r for page in pages for r in page.get("records", [])]
+    return records, nhits
+
 
 # Crée un client S3 (assure-toi que les credentials AWS sont configurés sur ton EC2)
 s3 = boto3.client("s3")
 
-déjà_vus = set()
+déjà_vus = DedupCache().load()
+writer = RollingWriter(s3, déjà_vus).replay()
+
+session = make_session()
+executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+nhits = 0
 
 print("🚀 Démarrage de l’ingestion Rennes Métropole...")
 
 while True:
+    # Flush avant la collecte : les records d'un nouveau jour ouvrent un nouveau lot
+    try:
+        if writer.should_flush():
+            writer.flush()
+    except Exception as e:
+        print(f"⚠️ Erreur lors de l’upload du lot (nouvel essai au prochain tick) : {str(e)}")
+
     try:
-        response = requests.get(URL)
-        if response.status_code == 200:
-            data = response.json()
-            records = data.get("records", [])
-
-            if records:
-                flat_records = []
-
-                for record in records:
-                    record_id = record.get("recordid")
-                    if record_id and record_id not in déjà_vus:
-                        déjà_vus.add(record_id)
-                        fields = record.get("fields", {})
-                        fields["recordid"] = record_id
-                        flat_records.append(fields)
-
-                if flat_records:
-                    pandas_df = pd.DataFrame(flat_records)
-
-                    # Génération du chemin S3
-                    now = datetime.now()
-                    filename = f"{now.strftime('%H%M%S')}.csv"
-                    s3_key = f"{S3_FOLDER}{now.year}/{now.month:02d}/{now.day:02d}/{filename}"
-
-                    # Conversion en CSV en mémoire
-                    csv_buffer = StringIO()
-                    pandas_df.to_csv(csv_buffer, index=False)
-
-                    # Upload direct vers S3
-                    s3.put_object(
-                        Bucket=BUCKET_NAME,
-                        Key=s3_key,
-                        Body=csv_buffer.getvalue()
-                    )
-
-                    print(f"[{datetime.now()}] ☁️  Fichier uploadé sur S3 : s3://{BUCKET_NAME}/{s3_key}")
-                else:
-                    print(f"[{datetime.now()}] Aucun nouvel enregistrement.")
+        records, nhits = fetch_snapshot(session, executor, expected_hits=nhits)
+
+        if records:
+            flat_records = []
+
+            for record in records:
+                record_id = record.get("recordid")
+                if record_id and record_id not in déjà_vus:
+                    déjà_vus.add(record_id)
+                    fields = record.get("fields", {})
+                    fields["recordid"] = record_id
+                    flat_records.append(fields)
+
+            if flat_records:
+                writer.append(flat_records)
+                print(f"[{datetime.now()}] {len(flat_records)}/{len(records)} nouveaux records "
+                      f"({len(writer.records)} en attente)")
             else:
-                print(f"[{datetime.now()}] Aucun record reçu de l’API.")
+                print(f"[{datetime.now()}] Aucun nouvel enregistrement.")
         else:
-            print(f"❌ Erreur API : {response.status_code}")
+            print(f"[{datetime.now()}] Aucun record reçu de l’API.")
 
     except Exception as e:
         print(f"⚠️ Erreur lors de l’appel API : {str(e)}")
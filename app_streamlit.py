@@ -1,33 +1,118 @@
 # app_cityflow_dashboard.py
+import os
+import sys
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
 import requests
 import plotly.express as px
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from dashboard_cache import DiskCache, fetch_days
 
 st.set_page_config(page_title="🚦 Dashboard Trafic & 🚲 Vélo", layout="wide")
 st.title("🌍 CityFlow — Trafic 🚗 & Vélo 🚲 Analytics (DynamoDB via API)")
 
 API_TRAFFIC = "https://oeagxmsmhl.execute-api.eu-west-3.amazonaws.com/stage/stats-trafic"
 API_BIKE    = "https://oeagxmsmhl.execute-api.eu-west-3.amazonaws.com/stage/stats-velos"
+API_CATALOG = "https://oeagxmsmhl.execute-api.eu-west-3.amazonaws.com/stage/catalog"
+PREFETCH_DATES = 3  # Dernières dates préchargées en arrière-plan
+LAKE_ROOT = os.environ.get("CITYFLOW_LAKE_ROOT")  # Dossier local ou s3://bucket : active les requêtes SQL DuckDB
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
 
 # --------------------------
 # 🔧 Utils
 # --------------------------
+@st.cache_resource
+def http_session():
+    """Session HTTP partagée (keep-alive) : les connexions TLS sont réutilisées entre appels et reruns."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                          max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+    session.mount("https://", adapter)
+    session.headers.update({"Accept": f"{ARROW_STREAM}, application/json;q=0.5"})
+    return session
+
+@st.cache_resource
+def disk_cache():
+    """Cache Parquet local par (endpoint, jour) : survit aux redémarrages de l'app."""
+    return DiskCache()
+
+@st.cache_resource
+def fetch_pool():
+    return ThreadPoolExecutor(max_workers=8)
+
+def read_response(r):
+    """Réponse API -> DataFrame : flux Arrow (colonnes typées) ou JSON dict(items=[]) / liste brute."""
+    if r.headers.get("Content-Type", "").startswith(ARROW_STREAM):
+        return pa.ipc.open_stream(r.content).read_pandas()
+    data = r.json()
+    if isinstance(data, dict) and "items" in data:
+        data = data["items"]
+    elif isinstance(data, dict):
+        data = [data]
+    return pd.DataFrame(data)
+
+def fetch_api(session, url, params=None):
+    """Appel API simple, sans appel st.* (utilisable depuis des threads)."""
+    r = session.get(url, params=params or {}, timeout=10)
+    r.raise_for_status()
+    return read_response(r)
+
 @st.cache_data(ttl=300)
-def call_api(url, params=None):
-    """Appel API robuste : supporte dict(items=[]) ou liste brute."""
+def call_apis(calls):
+    """Lance les appels ((url, params), ...) en parallèle sur la session partagée.
+
+    Renvoie (DataFrames dans l'ordre des appels, erreurs) ; un appel en échec donne un DataFrame vide.
+    """
+    session = http_session()
+    frames, errors = [], []
+    with ThreadPoolExecutor(max_workers=max(1, len(calls))) as pool:
+        futures = [pool.submit(fetch_api, session, url, dict(params)) for url, params in calls]
+        for (url, _), future in zip(calls, futures):
+            try:
+                frames.append(future.result())
+            except Exception as e:
+                errors.append(f"Erreur API {url}: {e}")
+                frames.append(pd.DataFrame())
+    return frames, errors
+
+@st.cache_data(ttl=60)
+def load_catalog():
+    """Dates disponibles (plus récente d'abord) et entrées par jeu de données ; None si l'API est injoignable."""
     try:
-        r = requests.get(url, params=params or {}, timeout=10)
+        r = http_session().get(API_CATALOG, timeout=10, headers={"Accept": "application/json"})
         r.raise_for_status()
-        data = r.json()
-        if isinstance(data, dict) and "items" in data:
-            data = data["items"]
-        elif isinstance(data, dict):
-            data = [data]
-        return pd.DataFrame(data)
-    except Exception as e:
-        st.error(f"Erreur API {url}: {e}")
-        return pd.DataFrame()
+        return r.json()
+    except Exception:
+        return None
+
+def catalog_updates(catalog):
+    """(endpoint, jour) -> dernière mise à jour connue : invalide les jours clos réécrits depuis leur mise en cache."""
+    updates = {}
+    for url, dataset in ((API_TRAFFIC, "traffic"), (API_BIKE, "bike")):
+        for entry in ((catalog or {}).get("datasets") or {}).get(dataset, []):
+            updates[(url, entry["day"])] = entry.get("updated_at")
+    return updates
+
+def load_days(days, updates):
+    """Données brutes trafic et vélo, un fichier de cache par jour (requêtes restantes en parallèle)."""
+    targets = [(url, d) for url in (API_TRAFFIC, API_BIKE) for d in days]
+    frames, stats = fetch_days(disk_cache(), http_session(), targets, read_response, updates, executor=fetch_pool())
+    n = len(days)
+    return pd.concat(frames[:n], ignore_index=True), pd.concat(frames[n:], ignore_index=True), stats
+
+@st.cache_resource
+def prefetch_pool():
+    return ThreadPoolExecutor(max_workers=1)
+
+def prefetch(days, updates):
+    """Précharge en arrière-plan les jours les plus probables dans le cache disque."""
+    targets = [(url, d) for d in days for url in (API_TRAFFIC, API_BIKE)]
+    if targets:
+        prefetch_pool().submit(fetch_days, disk_cache(), http_session(), targets, read_response, updates)
 
 def coerce_numeric(df, cols):
     for c in cols:
@@ -43,9 +128,14 @@ def clean_cols(df):
 # 🎛️ Filtres
 # --------------------------
 st.sidebar.header("Filtres")
-# Quelques dates connues de ton jeu (tu peux en ajouter)
-known_dates = ["2025-11-04", "2025-11-03", "2025-10-17", "2025-09-03", "2025-09-02", "2025-09-01"]
-dates = st.sidebar.multiselect("📅 Sélectionne une ou plusieurs dates", options=known_dates, default=["2025-11-04"])
+# Dates disponibles lues dans le catalogue des partitions (repli sur quelques dates connues)
+catalog = load_catalog()
+known_dates = (catalog or {}).get("dates") or ["2025-11-04", "2025-11-03", "2025-10-17", "2025-09-03", "2025-09-02", "2025-09-01"]
+if catalog is None:
+    st.sidebar.warning("Catalogue indisponible : liste de dates par défaut.")
+dates = st.sidebar.multiselect("📅 Sélectionne une ou plusieurs dates", options=known_dates, default=known_dates[:1])
+updates = catalog_updates(catalog)
+prefetch([d for d in known_dates[:PREFETCH_DATES] if d not in dates], updates)
 
 departement_filter = st.sidebar.text_input("Département (optionnel)", "")
 niveau_filter = st.sidebar.multiselect("Niveau de congestion (optionnel)", options=["Faible","Modérée","Forte"], default=[])
@@ -55,13 +145,34 @@ bike_loc_filter = st.sidebar.text_input("Emplacement vélo (contient, optionnel)
 # --------------------------
 # 📦 Chargement des données
 # --------------------------
-# Trafic : concat sur plusieurs dates
-df_traffic = pd.concat([call_api(API_TRAFFIC, {"date": d}) for d in dates], ignore_index=True)
-df_traffic = clean_cols(df_traffic)
-
-# Vélo : concat sur plusieurs dates
-df_bike = pd.concat([call_api(API_BIKE, {"date": d}) for d in dates], ignore_index=True)
-df_bike = clean_cols(df_bike)
+# Sans filtre "contient" côté app, les graphiques trafic viennent déjà agrégés de l'API
+server_agg = not (departement_filter or niveau_filter or rue_filter)
+AGG_TOP_RUES = (("group_by", "nom_rue"), ("metric", "taux_congestion_pct"), ("agg", "mean"), ("top", "10"))
+AGG_HEATMAP = (("group_by", "nom_rue,heure_de_pointe"), ("metric", "taux_congestion_pct"), ("agg", "mean"))
+AGG_SPEED_HOUR = (("group_by", "heure_de_pointe"), ("metric", "vitesse_moyenne_kmh"), ("agg", "mean"))
+
+# Trafic + vélo : cache disque par jour (jours clos sans requête, jour courant revalidé par ETag)
+# Agrégats : une requête multi-dates par graphique, lancées en parallèle
+df_traffic, df_bike = pd.DataFrame(), pd.DataFrame()
+agg_top, agg_heat, agg_speed = None, None, None
+if dates:
+    df_traffic, df_bike, cache_stats = load_days(sorted(dates), updates)
+    api_errors = cache_stats["errors"]
+    if server_agg:
+        date_params = (("dates", ",".join(sorted(dates))),)
+        frames, agg_errors = call_apis(tuple((API_TRAFFIC, date_params + agg)
+                                             for agg in (AGG_TOP_RUES, AGG_HEATMAP, AGG_SPEED_HOUR)))
+        agg_top, agg_heat, agg_speed = (coerce_numeric(f.copy(), ["taux_congestion_pct", "vitesse_moyenne_kmh"])
+                                        for f in frames)
+        api_errors += agg_errors
+    for err in api_errors:
+        st.error(err)
+    st.sidebar.caption(
+        f"Cache : {cache_stats['disk']} jour(s) disque, {cache_stats['revalidated']} revalidé(s), "
+        f"{cache_stats['fetched']} téléchargé(s) en {cache_stats['elapsed_s'] * 1000:.0f} ms"
+    )
+df_traffic = clean_cols(df_traffic.copy())
+df_bike = clean_cols(df_bike.copy())
 
 st.sidebar.success(f"Trafic: {len(df_traffic)} lignes | Vélo: {len(df_bike)} lignes")
 
@@ -114,13 +225,16 @@ else:
         # Top 10 rues par congestion moyenne
         if "nom_rue" in df_traffic.columns and "taux_congestion_pct" in df_traffic.columns:
             st.subheader("🏆 Top 10 rues les plus congestionnées (moyenne %)")
-            top_cong = (
-                df_traffic.groupby("nom_rue")["taux_congestion_pct"]
-                .mean()
-                .sort_values(ascending=False)
-                .head(10)
-                .reset_index()
-            )
+            if agg_top is not None and not agg_top.empty:
+                top_cong = agg_top[["nom_rue", "taux_congestion_pct"]]
+            else:
+                top_cong = (
+                    df_traffic.groupby("nom_rue")["taux_congestion_pct"]
+                    .mean()
+                    .sort_values(ascending=False)
+                    .head(10)
+                    .reset_index()
+                )
             fig_top = px.bar(
                 top_cong, x="nom_rue", y="taux_congestion_pct", text="taux_congestion_pct",
                 labels={"nom_rue":"Rue","taux_congestion_pct":"Congestion (%)"},
@@ -138,7 +252,8 @@ else:
                     return int("".join([ch for ch in str(h) if ch.isdigit()]) or 0)
                 except:
                     return 0
-            heat = df_traffic.pivot_table(
+            heat_src = agg_heat if agg_heat is not None and not agg_heat.empty else df_traffic
+            heat = heat_src.pivot_table(
                 index="nom_rue", columns="heure_de_pointe",
                 values="taux_congestion_pct", aggfunc="mean"
             )
@@ -156,8 +271,9 @@ else:
         if {"heure_de_pointe","vitesse_moyenne_kmh"}.issubset(df_traffic.columns):
             st.subheader("📈 Vitesse moyenne par heure de pointe")
             # heuristique tri heures
-            df_traffic["_heure_num"] = df_traffic["heure_de_pointe"].astype(str).str.extract(r"(\d+)").astype(float)
-            speed_hour = df_traffic.groupby("_heure_num")["vitesse_moyenne_kmh"].mean().reset_index().sort_values("_heure_num")
+            speed_src = agg_speed.copy() if agg_speed is not None and not agg_speed.empty else df_traffic
+            speed_src["_heure_num"] = speed_src["heure_de_pointe"].astype(str).str.extract(r"(\d+)").astype(float)
+            speed_hour = speed_src.groupby("_heure_num")["vitesse_moyenne_kmh"].mean().reset_index().sort_values("_heure_num")
             fig_hour = px.line(
                 speed_hour, x="_heure_num", y="vitesse_moyenne_kmh",
                 markers=True, labels={"_heure_num":"Heure","vitesse_moyenne_kmh":"Vitesse (km/h)"},
@@ -275,5 +391,26 @@ if not df_traffic.empty and not df_bike.empty:
                 fig_corr.update_traces(textposition="top center")
                 st.plotly_chart(fig_corr, use_container_width=True)
 
+# ============================================================
+# 🦆 Requêtes SQL directes sur le lac (DuckDB, optionnel)
+# ============================================================
+if LAKE_ROOT:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambdas"))
+    import lake_query
+
+    with st.expander("🦆 Requête SQL sur le lac Parquet (silver / gold / état trafic)"):
+        st.caption(f"Racine : {LAKE_ROOT} — vues : {', '.join(lake_query.views(LAKE_ROOT))}")
+        default_sql = (
+            "SELECT part_date, Location_Name, sum(Counts) AS total\nFROM bike_silver\n"
+            f"WHERE part_date IN ({', '.join(repr(d) for d in sorted(dates)) or repr(known_dates[0])})\n"
+            "GROUP BY ALL ORDER BY total DESC LIMIT 20"
+        )
+        sql = st.text_area("SQL", default_sql, height=140)
+        if st.button("Exécuter"):
+            try:
+                st.dataframe(lake_query.query(sql, root=LAKE_ROOT).to_pandas())
+            except Exception as e:
+                st.error(f"Erreur DuckDB : {e}")
+
 st.markdown("---")
 st.caption("CityFlow • AWS Lambda + API Gateway + DynamoDB + Streamlit • KPIs, heatmaps, comparatifs 🚀")
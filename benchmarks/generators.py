@@ -0,0 +1,126 @@
+"""Générateurs de données synthétiques pour les benchmarks CityFlow.
+
+Les données sont produites par blocs (``chunk_rows``) : 10^8 lignes s'écrivent sur disque
+sans jamais tenir en mémoire. Les valeurs suivent les formats réels :
+
+- compteurs vélo : export CSV eco-counter de Rennes Métropole (date, isodate, counts, ...) ;
+- état du trafic : records ``fields`` du dataset etat-du-trafic-en-temps-reel.
+
+Usage : python -m benchmarks.generators bike 1e6 bike.csv
+"""
+import argparse
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 1_000_000
+START = datetime(2025, 9, 1, tzinfo=timezone.utc)
+
+
+def bike_chunks(rows, sensors=80, start=START, chunk_rows=CHUNK_ROWS, seed=0):
+    """Relevés horaires eco-counter : un relevé par capteur et par heure, en séquence."""
+    rng = np.random.default_rng(seed)
+    sensor_ids = np.array([f"{100047000 + i}" for i in range(sensors)])
+    names = np.array([f"Compteur {i:03d} - Rue {i % 37}" for i in range(sensors)])
+    lat = 48.08 + rng.random(sensors) * 0.06
+    lon = -1.72 + rng.random(sensors) * 0.09
+    geo = np.array([f"{a:.6f},{b:.6f}" for a, b in zip(lat, lon)])
+    directions = np.array(["Nord", "Sud", "Est", "Ouest"])
+    start_ns = pd.Timestamp(start).value
+
+    for offset in range(0, int(rows), chunk_rows):
+        n = min(chunk_rows, int(rows) - offset)
+        idx = np.arange(offset, offset + n)
+        sensor = idx % sensors
+        hour = idx // sensors
+        dates = pd.to_datetime(start_ns + hour * 3_600_000_000_000, utc=True)
+        # Profil journalier (pointes 8h / 18h) + bruit ; quelques valeurs manquantes comme en vrai
+        h = dates.hour.to_numpy()
+        base = 20 + 60 * np.exp(-((h - 8) ** 2) / 4) + 70 * np.exp(-((h - 18) ** 2) / 5)
+        counts = rng.poisson(base * (0.5 + (sensor % 7) / 7)).astype("float64")
+        counts[rng.random(n) < 0.002] = np.nan
+        yield pd.DataFrame({
+            "date": dates.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "isodate": dates.strftime("%Y-%m-%d"),
+            "counts": counts,
+            "status": np.where(rng.random(n) < 0.01, "raw", "modified"),
+            "id": sensor_ids[sensor],
+            "name": names[sensor],
+            "geo": geo[sensor],
+            "sens": directions[sensor % 4],
+        })
+
+
+def bike_delta(df):
+    """Passe un bloc du format export au format des deltas écrits par ingestion_bike."""
+    return df.rename(columns={
+        "date": "Date", "isodate": "ISO_Date", "counts": "Counts", "status": "Status",
+        "id": "Sensor_ID", "name": "Location_Name", "geo": "Coordinates", "sens": "Direction",
+    })
+
+
+def traffic_chunks(rows, segments=2_000, start=START, chunk_rows=CHUNK_ROWS, seed=0):
+    """Records etat-du-trafic : un relevé par tronçon toutes les 3 minutes."""
+    rng = np.random.default_rng(seed)
+    vmax = rng.choice([30.0, 50.0, 70.0, 90.0, 110.0], size=segments)
+    length_m = 100 + rng.random(segments) * 900
+    start_ns = pd.Timestamp(start).value
+    streets = np.array([f"Rue {i % 400}" for i in range(segments)])
+
+    for offset in range(0, int(rows), chunk_rows):
+        n = min(chunk_rows, int(rows) - offset)
+        idx = np.arange(offset, offset + n)
+        seg = idx % segments
+        tick = idx // segments
+        dates = pd.to_datetime(start_ns + tick * 180_000_000_000, utc=True)
+        h = dates.hour.to_numpy()
+        rush = np.exp(-((h - 8) ** 2) / 3) + np.exp(-((h - 17.5) ** 2) / 4)
+        speed = np.clip(vmax[seg] * (1 - 0.6 * rush * rng.random(n)) + rng.normal(0, 3, n), 3, None).round()
+        traveltime = (length_m[seg] / (speed / 3.6)).round()
+        ratio = speed / vmax[seg]
+        yield pd.DataFrame({
+            "datetime": dates.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "predefinedlocationreference": (seg + 10_000).astype(str),
+            "denomination": streets[seg],
+            "vitesse_maxi": vmax[seg],
+            "averagevehiclespeed": speed,
+            "traveltime": traveltime,
+            "traveltimereliability": 100.0,
+            "trafficstatus": np.select([ratio < 0.4, ratio < 0.7], ["congested", "heavy"], "freeFlow"),
+            "vehicleprobemeasurement": rng.integers(0, 25, n).astype("float64"),
+            "id_rva_troncon_fcd_v1_1": (seg + 1).astype("float64"),
+            "hierarchie": "Voie principale",
+        })
+
+
+GENERATORS = {"bike": bike_chunks, "traffic": traffic_chunks}
+
+
+def write_csv(path, chunks):
+    """Écrit les blocs dans un CSV (en-tête une seule fois). Renvoie le nombre de lignes."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    total = 0
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, index=False, header=(i == 0))
+            total += len(chunk)
+    os.replace(tmp, path)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Génère un jeu de données synthétique CityFlow en CSV")
+    parser.add_argument("kind", choices=sorted(GENERATORS))
+    parser.add_argument("rows", type=float, help="Nombre de lignes (ex. 1e6)")
+    parser.add_argument("output")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    total = write_csv(args.output, GENERATORS[args.kind](int(args.rows), seed=args.seed))
+    print(f"{total} lignes écrites dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
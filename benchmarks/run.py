@@ -0,0 +1,136 @@
+"""Lance les benchmarks CityFlow et ajoute les résultats à un historique JSON comparable.
+
+Chaque (étape, taille) tourne dans un sous-processus neuf : RSS max et compteurs d'appels
+AWS ne se mélangent pas d'une mesure à l'autre. Les jeux de données synthétiques sont
+générés une fois par (type, taille) et réutilisés. Une taille au-delà du plafond d'une étape
+(``STAGES`` dans benchmarks.stages : 10^6 à 10^7 lignes) est ignorée pour cette étape ; les
+générateurs seuls vont jusqu'à 10^8 lignes (python -m benchmarks.generators).
+
+Exemples :
+    python -m benchmarks.run                                   # toutes les étapes, 10^4 et 10^5 lignes
+    python -m benchmarks.run --stages clean_bike aggregate_bike --sizes 1e6
+    python -m benchmarks.run --sizes 1e7 --stages ingestion_clean_data traffic_aggregate
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from benchmarks.generators import GENERATORS, write_csv
+from benchmarks.stages import ROOT, STAGES
+
+DATA_DIR = os.path.join(ROOT, "benchmarks", ".data")
+HISTORY_FILE = os.path.join(ROOT, "benchmarks", "history.json")
+REGRESSION_PCT = 10  # Écart signalé par rapport à la mesure précédente
+
+
+def dataset(kind, rows, seed=0):
+    path = os.path.join(DATA_DIR, f"{kind}-{rows}-s{seed}.csv")
+    if not os.path.exists(path):
+        print(f"🧪 Génération {kind} ({rows} lignes) -> {path}")
+        write_csv(path, GENERATORS[kind](rows, seed=seed))
+    return path
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_one(stage, path, timeout):
+    proc = subprocess.run([sys.executable, "-m", "benchmarks.stages", stage, path], cwd=ROOT,
+                          capture_output=True, text=True, timeout=timeout)
+    if proc.returncode != 0:
+        return {"stage": stage, "error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "échec"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_history(path, history):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def previous_result(history, stage, size):
+    for run in reversed(history):
+        for result in run["results"]:
+            if result.get("stage") == stage and result.get("size") == size and "seconds" in result:
+                return {**result, "commit": run.get("commit")}
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks des étapes du pipeline CityFlow")
+    parser.add_argument("--stages", nargs="+", choices=sorted(STAGES), default=sorted(STAGES))
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e4, 1e5],
+                        help="Lignes générées (10^4 jusqu'au plafond de chaque étape)")
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument("--label", default=None, help="Étiquette libre de la série (ex. nom de branche)")
+    parser.add_argument("--timeout", type=int, default=3600, help="Limite par étape, en secondes")
+    args = parser.parse_args(argv)
+
+    history = load_history(args.history)
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": args.label,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": [],
+    }
+
+    for size in (int(s) for s in args.sizes):
+        for stage in args.stages:
+            kind, _, max_rows = STAGES[stage]
+            if size > max_rows:
+                print(f"⏭️  {stage} [{size}] : au-delà du plafond de l'étape ({max_rows:,} lignes)")
+                continue
+            result = {**run_one(stage, dataset(kind, size), args.timeout), "size": size}
+            run["results"].append(result)
+            if "error" in result:
+                print(f"❌ {stage} [{size}] : {result['error']}")
+                continue
+
+            # Mémoire propre à l'étape (hausse de RSS pendant la mesure) si disponible
+            memory = result.get("stage_rss_mb")
+            memory = f"+{memory:.1f} Mo" if memory is not None else f"{result['peak_rss_mb']:.1f} Mo*"
+            line = (f"⏱️  {stage:<22} {size:>11,} lignes  {result['seconds']:>9.3f}s  "
+                    f"{result['rows_per_s'] or 0:>12,.0f} lignes/s  {memory:>11}  "
+                    f"{result['api_calls_total']:>6} appels AWS")
+            before = previous_result(history, stage, size)
+            if before:
+                delta = (result["seconds"] - before["seconds"]) / before["seconds"] * 100
+                flag = " ⚠️ régression" if delta > REGRESSION_PCT else ""
+                line += f"  ({delta:+.1f}% vs {before.get('commit') or 'précédent'}){flag}"
+                if result.get("stage_rss_mb") and before.get("stage_rss_mb"):
+                    mem_delta = (result["stage_rss_mb"] - before["stage_rss_mb"]) / before["stage_rss_mb"] * 100
+                    if mem_delta > REGRESSION_PCT:
+                        line += f"  ⚠️ mémoire {mem_delta:+.1f}%"
+            print(line)
+
+    for result in run["results"]:
+        before = previous_result(history, result.get("stage"), result["size"])
+        if before:
+            result["previous_commit"] = before.get("commit")
+    history.append(run)
+    save_history(args.history, history)
+    print(f"📝 Résultats ajoutés à {args.history}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""Étapes du pipeline mesurées par les benchmarks, chacune exécutée dans son propre processus.
+
+S3 et DynamoDB sont simulés par moto ; l'invocation asynchrone de la lambda d'agrégation
+est remplacée par un enregistreur (moto exécuterait la lambda dans Docker). Chaque appel
+boto3 est compté en enveloppant ``botocore.client.BaseClient._make_api_call``.
+
+Chaque étape reçoit le CSV déjà chargé en mémoire (les lambdas lisent leurs entrées en entier) :
+``STAGES`` fixe donc un nombre maximal de lignes par étape, vérifié à la lecture. Le RSS max est
+mesuré sur la seule exécution chronométrée (remise à zéro de VmHWM sous Linux), hors préparation.
+
+Usage (lancé par benchmarks.run) : python -m benchmarks.stages <étape> <fichier CSV>
+Le résultat est imprimé en une ligne JSON sur la sortie standard.
+"""
+import importlib.util
+import io
+import json
+import os
+import resource
+import sys
+import time
+from collections import Counter
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDAS = os.path.join(ROOT, "lambdas")
+BUCKET = "cityflow-raw0"
+REGION = "eu-west-3"
+
+# Identifiants factices : aucune requête ne sort de moto
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_SESSION_TOKEN", "testing")
+os.environ["AWS_DEFAULT_REGION"] = REGION
+os.environ["AWS_REGION"] = REGION
+sys.path[:0] = [ROOT, LAMBDAS]
+
+import boto3  # noqa: E402
+import botocore.client  # noqa: E402
+import pandas as pd  # noqa: E402
+from moto import mock_aws  # noqa: E402
+
+from benchmarks.generators import bike_delta  # noqa: E402
+
+API_CALLS = Counter()
+_make_api_call = botocore.client.BaseClient._make_api_call
+
+
+def _counting_api_call(self, operation_name, api_params):
+    API_CALLS[f"{self.meta.service_model.service_name}:{operation_name}"] += 1
+    return _make_api_call(self, operation_name, api_params)
+
+
+botocore.client.BaseClient._make_api_call = _counting_api_call
+
+
+class InvokeRecorder:
+    """Remplace le client Lambda : enregistre les invocations au lieu de les exécuter."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        API_CALLS["lambda:Invoke"] += 1
+        self.payloads.append(json.loads(Payload))
+        return {"StatusCode": 202}
+
+
+def load_module(name, filename):
+    """Importe un fichier de lambdas/ (noms avec tirets ou accents compris)."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(LAMBDAS, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def create_bucket():
+    boto3.client("s3").create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION})
+
+
+def create_table(name, pk, sk, index_name, index_pk):
+    ddb = boto3.client("dynamodb")
+    attrs = {pk, sk, index_pk}
+    ddb.create_table(
+        TableName=name,
+        KeySchema=[{"AttributeName": pk, "KeyType": "HASH"}, {"AttributeName": sk, "KeyType": "RANGE"}],
+        AttributeDefinitions=[{"AttributeName": a, "AttributeType": "S"} for a in sorted(attrs)],
+        BillingMode="PAY_PER_REQUEST",
+        GlobalSecondaryIndexes=[{
+            "IndexName": index_name,
+            "KeySchema": [{"AttributeName": index_pk, "KeyType": "HASH"}],
+            "Projection": {"ProjectionType": "ALL"},
+        }],
+    )
+    return boto3.resource("dynamodb").Table(name)
+
+
+def parquet_bytes(df):
+    buf = io.BytesIO()
+    df.to_parquet(buf, index=False)
+    return buf.getvalue()
+
+
+# ----------------------------
+# ÉTAPES
+# ----------------------------
+# Chaque étape prépare ses données (non chronométré) puis renvoie (fonction mesurée, lignes en entrée)
+
+def stage_ingestion_clean_data(df):
+    import ingestion_bike
+    from datetime import datetime, timezone
+
+    since = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    return (lambda: ingestion_bike.clean_data(df, since=since, verbose=False)), len(df)
+
+
+def stage_clean_bike(df):
+    create_bucket()
+    df = bike_delta(df)
+    boto3.client("s3").put_object(Bucket=BUCKET, Key="bike/bench.parquet", Body=parquet_bytes(df))
+    import clean_bike
+
+    clean_bike.LMB = InvokeRecorder()
+    event = {"Records": [{"s3": {"bucket": {"name": BUCKET}, "object": {"key": "bike/bench.parquet"}}}]}
+    return (lambda: clean_bike.lambda_handler(event, None)), len(df)
+
+
+def stage_aggregate_bike(df):
+    create_bucket()
+    create_table("TrafficAggregated", "Location_Name", "Date", "Date-index", "Date")
+    df = bike_delta(df)
+    df["Date"] = pd.to_datetime(df["Date"], utc=True)
+    df["day"] = df["Date"].dt.strftime("%Y-%m-%d")
+    s3 = boto3.client("s3")
+    for day, part in df.groupby("day"):
+        s3.put_object(Bucket=BUCKET, Key=f"silver/date={day}/part-bench.parquet", Body=parquet_bytes(part))
+    days = sorted(df["day"].unique())
+    import aggregate_bike
+
+    return (lambda: [aggregate_bike.lambda_handler({"day": day}, None) for day in days]), len(df)
+
+
+def stage_traffic_aggregate(df):
+    job = load_module("etat_trafic", "lambda-function-etat-trafic.py")
+
+    def run():
+        hourly, daily = job.aggregate_data(job.clean_and_prepare(df.copy()))
+        return len(daily)
+
+    return run, len(df)
+
+
+def _fill_table(table, items):
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
+
+def stage_api_bike(df):
+    table = create_table("TrafficAggregated", "Location_Name", "Date", "Date-index", "Date")
+    df = bike_delta(df)
+    df["Date"] = pd.to_datetime(df["Date"], utc=True).dt.strftime("%Y-%m-%d")
+    daily = df.groupby(["Location_Name", "Date"], as_index=False).agg(
+        total_counts=("Counts", "sum"),
+        avg_counts=("Counts", "mean"),
+    )
+    _fill_table(table, (
+        {"Location_Name": r.Location_Name, "Date": r.Date,
+         "total_counts": Decimal(repr(float(r.total_counts))), "avg_counts": Decimal(repr(float(r.avg_counts)))}
+        for r in daily.itertuples()
+    ))
+    api = load_module("api_velo", "api_vélo.py")
+    dates = sorted(daily["Date"].unique())
+    events = [{"queryStringParameters": {"date": d}} for d in dates]
+    events.append({"queryStringParameters": {"dates": ",".join(dates[:31]), "format": "arrow"}})
+
+    def run():
+        for event in events:
+            api.CACHE._entries.clear()  # Mesure du chemin DynamoDB, pas du cache chaud
+            api.lambda_handler(event, None)
+
+    return run, len(daily)
+
+
+def stage_api_traffic(df):
+    table = create_table("stats-jours-trafic", "id", "date", "date-index", "date")
+    df["date"] = pd.to_datetime(df["datetime"], utc=True).dt.strftime("%Y-%m-%d")
+    daily = df.groupby(["id_rva_troncon_fcd_v1_1", "date"], as_index=False).agg(
+        nom_rue=("denomination", "first"),
+        vitesse_moyenne_kmh=("averagevehiclespeed", "mean"),
+        taux_congestion_pct=("averagevehiclespeed", lambda s: float((s < 30).mean() * 100)),
+    )
+    _fill_table(table, (
+        {"id": str(int(r.id_rva_troncon_fcd_v1_1)), "date": r.date, "nom_rue": r.nom_rue,
+         "heure_de_pointe": "8h", "vitesse_moyenne_kmh": Decimal(repr(float(r.vitesse_moyenne_kmh))),
+         "taux_congestion_pct": Decimal(repr(float(r.taux_congestion_pct)))}
+        for r in daily.itertuples()
+    ))
+    api = load_module("api_traffic", "api_traffic.py")
+    dates = sorted(daily["date"].unique())
+    events = [{"queryStringParameters": {"date": d}} for d in dates]
+    events.append({"queryStringParameters": {"dates": ",".join(dates[:31]), "group_by": "nom_rue",
+                                             "metric": "taux_congestion_pct", "agg": "mean", "top": "10"}})
+
+    def run():
+        for event in events:
+            api.CACHE._entries.clear()
+            api.lambda_handler(event, None)
+
+    return run, len(daily)
+
+
+# Étape -> (type de données, fonction, lignes max). Plafonds : entrée entière en mémoire, et pour
+# les étapes S3/DynamoDB, objets et tables simulés par moto dans le même processus
+STAGES = {
+    "ingestion_clean_data": ("bike", stage_ingestion_clean_data, 10_000_000),
+    "clean_bike": ("bike", stage_clean_bike, 2_000_000),
+    "aggregate_bike": ("bike", stage_aggregate_bike, 2_000_000),
+    "traffic_aggregate": ("traffic", stage_traffic_aggregate, 10_000_000),
+    "api_bike": ("bike", stage_api_bike, 1_000_000),
+    "api_traffic": ("traffic", stage_api_traffic, 1_000_000),
+}
+
+
+def read_input(path, max_rows):
+    """Lit le CSV d'entrée sans jamais dépasser ``max_rows`` lignes en mémoire."""
+    df = pd.read_csv(path, nrows=max_rows + 1)
+    if len(df) > max_rows:
+        raise ValueError(f"{path} dépasse {max_rows} lignes, plafond de cette étape")
+    return df
+
+
+def _proc_status_kb(field):
+    """VmRSS / VmHWM du processus en Ko (Linux), None ailleurs."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Remet VmHWM au RSS courant (Linux >= 4.0) : le pic mesuré ne couvre plus la préparation."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def run_stage(name, path):
+    """Prépare puis chronomètre une étape ; renvoie temps, débit, mémoire et appels AWS.
+
+    ``peak_rss_mb`` est le pic de RSS pendant l'exécution chronométrée et ``stage_rss_mb`` sa
+    hausse par rapport au RSS juste avant. Sans /proc (``rss_scope`` = "process"), seul le pic
+    du processus entier, préparation comprise, est disponible.
+    """
+    kind, setup, max_rows = STAGES[name]
+    with mock_aws():
+        fn, rows = setup(read_input(path, max_rows))
+        API_CALLS.clear()  # Seuls les appels de l'étape mesurée comptent
+        baseline_kb = _proc_status_kb("VmRSS")
+        scoped = baseline_kb is not None and _reset_peak_rss()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        peak_kb = _proc_status_kb("VmHWM") if scoped else None
+    if peak_kb is None:
+        scoped = False
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Ko sous Linux
+    return {
+        "stage": name,
+        "rows": rows,
+        "seconds": round(elapsed, 4),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "stage_rss_mb": round((peak_kb - baseline_kb) / 1024, 1) if scoped else None,
+        "rss_scope": "stage" if scoped else "process",
+        "api_calls": dict(sorted(API_CALLS.items())),
+        "api_calls_total": sum(API_CALLS.values()),
+    }
+
+
+if __name__ == "__main__":
+    stage, data_path = sys.argv[1], sys.argv[2]
+    # Les étapes écrivent leurs logs sur stdout : le JSON part seul sur un descripteur à part
+    out = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    sys.stdout = sys.stderr
+    out.write(json.dumps(run_stage(stage, data_path)) + "\n")
+    out.flush()
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Dossier du cache local et taille maximale (au-delà : éviction LRU)
+CACHE_DIR = os.environ.get("DASHBOARD_CACHE_DIR", ".dashboard_cache")
+CACHE_MAX_BYTES = int(os.environ.get("DASHBOARD_CACHE_MAX_MB", 512)) * 1024 * 1024
+
+
+def today_utc():
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+class DiskCache:
+    """Cache Parquet sur disque, un fichier par (endpoint, jour).
+
+    Les métadonnées (ETag, date d'écriture) sont stockées dans le schéma Parquet. La date de
+    modification du fichier sert d'ordre LRU : chaque lecture la rafraîchit (os.utime).
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, endpoint, day):
+        # Endpoint haché : noms de fichiers sûrs quelle que soit l'URL
+        slug = hashlib.blake2b(endpoint.encode("utf-8"), digest_size=8).hexdigest()
+        return os.path.join(self.root, slug, f"date={day}.parquet")
+
+    def get(self, endpoint, day):
+        """Renvoie (DataFrame, métadonnées) ou (None, {}) si absent ou illisible."""
+        path = self._path(endpoint, day)
+        try:
+            table = pq.read_table(path)
+        except (FileNotFoundError, OSError, pa.ArrowInvalid):
+            return None, {}
+        os.utime(path)  # LRU
+        meta = json.loads((table.schema.metadata or {}).get(b"dashboard_cache", b"{}"))
+        return table.to_pandas(), meta
+
+    def put(self, endpoint, day, df, etag=None):
+        """Écrit le jour en Parquet (écriture atomique) ; False si le DataFrame n'est pas sérialisable."""
+        path = self._path(endpoint, day)
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return False
+        meta = {"etag": etag, "cached_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"dashboard_cache"] = json.dumps(meta).encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        pq.write_table(table.replace_schema_metadata(metadata), tmp, compression="zstd")
+        os.replace(tmp, path)
+        self.evict()
+        return True
+
+    def evict(self):
+        """Supprime les fichiers les moins récemment utilisés jusqu'à repasser sous max_bytes."""
+        with self._lock:
+            files = []
+            for dirpath, _, names in os.walk(self.root):
+                for name in names:
+                    if name.endswith(".parquet"):
+                        path = os.path.join(dirpath, name)
+                        stat = os.stat(path)
+                        files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+    def is_fresh(self, day, meta, updated_at=None):
+        """Jour clos (avant aujourd'hui, UTC) et non modifié depuis sa mise en cache : servi sans requête."""
+        if not day or day >= today_utc():
+            return False
+        return not updated_at or meta.get("cached_at", "") >= updated_at
+
+
+def fetch_days(cache, session, targets, read_response, updated=None, executor=None):
+    """Charge un DataFrame par (url, jour) : disque si frais, sinon requête conditionnelle (If-None-Match).
+
+    ``read_response`` transforme une réponse HTTP 200 en DataFrame ; ``updated`` associe à un
+    (url, jour) sa date de mise à jour dans le catalogue (invalide une entrée écrite avant).
+    Un appel en échec donne un DataFrame vide et un message dans ``stats["errors"]``.
+    Renvoie (DataFrames dans l'ordre des cibles, stats).
+    """
+    updated = updated or {}
+
+    def load(target):
+        url, day = target
+        try:
+            df, meta = cache.get(url, day)
+            if df is not None and cache.is_fresh(day, meta, updated.get(target)):
+                return df, "disk", None
+            headers = {"If-None-Match": meta["etag"]} if df is not None and meta.get("etag") else {}
+            r = session.get(url, params={"date": day}, headers=headers, timeout=10)
+            if r.status_code == 304:
+                cache.put(url, day, df, meta.get("etag"))  # Revalidé : date de vérification à jour
+                return df, "revalidated", None
+            r.raise_for_status()
+            fresh = read_response(r)
+            cache.put(url, day, fresh, r.headers.get("ETag"))
+            return fresh, "fetched", None
+        except Exception as e:
+            return pd.DataFrame(), "failed", f"Erreur API {url} ({day}): {e}"
+
+    started = time.perf_counter()
+    results = list(executor.map(load, targets)) if executor is not None else [load(t) for t in targets]
+    stats = {"disk": 0, "revalidated": 0, "fetched": 0, "failed": 0, "errors": []}
+    for _, source, err in results:
+        stats[source] += 1
+        if err:
+            stats["errors"].append(err)
+    stats["elapsed_s"] = time.perf_counter() - started
+    return [df for df, _, _ in results], stats
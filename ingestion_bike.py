@@ -1,22 +1,67 @@
+import json
 import pandas as pd
 import requests
 from io import StringIO
 import os
 import boto3
+import pyarrow as pa
 from datetime import datetime, timezone
 
+from s3_delta import is_delta_key, read_delta, write_delta
+
 
 
 DATA_URL = "https://data.rennesmetropole.fr/explore/dataset/eco-counter-data/download/?format=csv&timezone=Europe/Paris&use_labels_for_header=true"
 
+# API Explore v2.1 : export filtré côté serveur (where=date >= watermark), paginé par date
+EXPORT_API_URL = "https://data.rennesmetropole.fr/api/explore/v2.1/catalog/datasets/eco-counter-data/exports/csv"
+
+INCREMENTAL_FETCH = True
+
+PAGE_ROWS = 100_000
+
+# Validateurs HTTP (ETag / Last-Modified) de la dernière requête incrémentale
+HTTP_CACHE_FILE = "http_cache.json"
+
 S3_BUCKET_NAME = "cityflow-raw0"
 
 S3_PREFIX = "bike/"
 
+# Manifeste S3 des deltas (clé, nb de lignes, dates min/max)
+S3_MANIFEST_NAME = "_manifest.json"
+
+# Format des deltas envoyés sur S3 : "parquet", "csv.gz" ou "csv"
+OUTPUT_FORMAT = "parquet"
+
+PARQUET_COMPRESSION = "zstd"
+
+# Types explicites des deltas Parquet (évite la ré-inférence en aval)
+DELTA_SCHEMA = pa.schema([
+    ("Date", pa.timestamp("us", tz="UTC")),
+    ("ISO_Date", pa.string()),
+    ("Counts", pa.float64()),
+    ("Status", pa.string()),
+    ("Sensor_ID", pa.string()),
+    ("Location_Name", pa.string()),
+    ("Coordinates", pa.string()),
+    ("Direction", pa.string()),
+])
+
 LOCAL_REFERENCE_FILE = "cleaned_data.csv"
 
+# Manifeste des watermarks : dernière date ingérée et nombre de lignes par capteur
+WATERMARK_FILE = "watermarks.json"
+
 START_DATE = datetime(2025, 9, 1, tzinfo=timezone.utc)
 
+# Retard toléré d'un capteur sur le plus récent : au-delà, son watermark ne borne plus le flux
+LATENESS_DAYS = 7
+
+# Mode streaming : le CSV est lu par blocs depuis le flux HTTP
+STREAMING_MODE = True
+
+CHUNK_ROWS = 50_000
+
 
 
 
@@ -39,9 +84,135 @@ def load_data(data: str):
     return df
 
 
-def clean_data(df: pd.DataFrame):
+def _parse_stream(response, since: datetime, chunk_rows: int = CHUNK_ROWS):
+    """Parse un corps HTTP CSV par blocs en ne gardant que les lignes depuis ``since``.
+
+    Renvoie le DataFrame nettoyé et le nombre de lignes brutes lues.
+    """
+    response.raw.decode_content = True
+    reader = pd.read_csv(response.raw, delimiter=";", chunksize=chunk_rows, encoding="utf-8")
+
+    kept = []
+    total = 0
+    for chunk in reader:
+        total += len(chunk)
+        chunk = clean_data(chunk, since=since, verbose=False)
+        if not chunk.empty:
+            kept.append(chunk)
+
+    if not kept:
+        return pd.DataFrame(columns=["Date", "Counts", "Sensor_ID"]), total
+    return pd.concat(kept, ignore_index=True), total
+
+
+def stream_data(url: str, since: datetime = START_DATE, chunk_rows: int = CHUNK_ROWS):
+    """Télécharge et nettoie le CSV par blocs, sans jamais charger tout l'historique.
+
+    Le corps HTTP est lu en flux et parsé par blocs de ``chunk_rows`` lignes ;
+    les lignes antérieures à ``since`` sont éliminées dès le parsing.
+    """
+    print(f"🚀 Téléchargement en flux des données (depuis {since})...")
+    with requests.get(url, stream=True) as response:
+        if response.status_code != 200:
+            print(f"❌ Erreur de téléchargement : {response.status_code}")
+            return None
+        df, total = _parse_stream(response, since, chunk_rows)
+
+    print(f"📥 {total} lignes lues en flux.")
+    print(f"✅ {len(df)} lignes conservées (depuis {since})")
+    return df
+
+
+def load_http_cache(path: str = HTTP_CACHE_FILE):
+    """Charge les validateurs HTTP de la dernière requête incrémentale"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_http_cache(cache: dict, path: str = HTTP_CACHE_FILE):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _export_params(cursor: pd.Timestamp, limit: int):
+    return {
+        "where": f"date >= date'{cursor.tz_convert('UTC').strftime('%Y-%m-%dT%H:%M:%SZ')}'",
+        "order_by": "date",
+        "limit": limit,
+        "delimiter": ";",
+        "timezone": "Europe/Paris",
+        "use_labels": "false",
+    }
+
+
+def fetch_incremental(since: datetime, page_rows: int = PAGE_ROWS):
+    """Ne récupère que les lignes depuis ``since`` via l'API d'export filtrée.
+
+    Pagination par curseur sur la date (order_by=date) : la dernière date d'une page
+    pleine est re-demandée avec ``>=`` pour ne jamais couper un horodatage entre deux
+    pages. La première page est conditionnelle (If-None-Match / If-Modified-Since) :
+    un jeu de données inchangé coûte un 304. Renvoie (DataFrame, validateurs HTTP à
+    enregistrer une fois le delta chargé), ou (None, None) en cas d'erreur.
+    """
+    cursor = pd.Timestamp(since)
+    cache = load_http_cache()
+    pages = []
+    first_request = None
+    validators = {}
+
+    print(f"🚀 Récupération incrémentale depuis {cursor}...")
+    with requests.Session() as session:
+        limit = page_rows
+        while True:
+            params = _export_params(cursor, limit)
+            headers = {}
+            if first_request is None:
+                first_request = requests.Request("GET", EXPORT_API_URL, params=params).prepare().url
+                if cache.get("url") == first_request:
+                    if cache.get("etag"):
+                        headers["If-None-Match"] = cache["etag"]
+                    if cache.get("last_modified"):
+                        headers["If-Modified-Since"] = cache["last_modified"]
+
+            with session.get(EXPORT_API_URL, params=params, headers=headers, stream=True) as response:
+                if response.status_code == 304:
+                    print("ℹ️ Jeu de données inchangé (304).")
+                    return pd.DataFrame(columns=["Date", "Counts", "Sensor_ID"]), None
+                if response.status_code != 200:
+                    print(f"❌ Erreur API export : {response.status_code}")
+                    return None, None
+                if not validators:
+                    validators = {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                    }
+                page, raw_rows = _parse_stream(response, since)
+
+            if limit < 0 or raw_rows < limit or page.empty:
+                pages.append(page)
+                break
+
+            page_max = page["Date"].max()
+            if page_max <= cursor:
+                # Page pleine sur un seul horodatage : on lit le reste sans limite
+                limit = -1
+                continue
+            pages.append(page[page["Date"] < page_max])
+            cursor = page_max
+
+    df = pd.concat(pages, ignore_index=True).drop_duplicates(subset=["Date", "Sensor_ID"])
+    print(f"✅ {len(df)} lignes récupérées en {len(pages)} page(s) (depuis {since})")
+    return df, {"url": first_request, **validators}
+
+
+def clean_data(df: pd.DataFrame, since: datetime = START_DATE, verbose: bool = True):
     """Nettoie et formate les données brutes"""
-    print("🧹 Nettoyage des données...")
+    if verbose:
+        print("🧹 Nettoyage des données...")
 
     df.rename(columns={
         "date": "Date",
@@ -60,92 +231,263 @@ def clean_data(df: pd.DataFrame):
     df.dropna(subset=["Date", "Counts"], inplace=True)
 
     # Filtrer à partir de la date définie
-    df = df[df["Date"] >= START_DATE]
+    df = df[df["Date"] >= since]
 
-    print(f"✅ {len(df)} lignes après nettoyage (depuis {START_DATE.date()})")
+    if verbose:
+        print(f"✅ {len(df)} lignes après nettoyage (depuis {since.date()})")
     return df
 
 
 
+def load_watermarks(path: str = WATERMARK_FILE):
+    """Charge le manifeste des watermarks par capteur (Sensor_ID -> last_date, rows)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    watermarks = {
+        sensor: {"last_date": pd.Timestamp(wm["last_date"]), "rows": int(wm.get("rows", 0))}
+        for sensor, wm in raw.get("sensors", {}).items()
+    }
+    print(f"🕓 Watermarks chargés pour {len(watermarks)} capteurs.")
+    return watermarks
+
+
+def save_watermarks(watermarks: dict, path: str = WATERMARK_FILE):
+    """Écrit le manifeste de façon atomique (fichier temporaire puis renommage)"""
+    payload = {
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "sensors": {
+            sensor: {"last_date": wm["last_date"].isoformat(), "rows": wm["rows"]}
+            for sensor, wm in sorted(watermarks.items())
+        },
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, path)
+    print(f"💾 Watermarks mis à jour : {path} ({len(watermarks)} capteurs)")
+
+
+def append_to_reference(df: pd.DataFrame, path: str = LOCAL_REFERENCE_FILE):
+    """Ajoute un delta au fichier local en respectant l'ordre de ses colonnes"""
+    if os.path.exists(path):
+        header = pd.read_csv(path, nrows=0).columns
+        df.reindex(columns=header).to_csv(path, mode="a", index=False, header=False)
+    else:
+        df.to_csv(path, index=False)
+    print(f"💾 Fichier local complété : {path}")
+
+
+def watermarks_from_reference(path: str = LOCAL_REFERENCE_FILE):
+    """Reconstruit les watermarks à partir de l'ancien fichier local (migration, une seule fois)"""
+    if not os.path.exists(path):
+        return {}
+    print(f"🔁 Construction des watermarks depuis {path}...")
+    watermarks = {}
+    for chunk in pd.read_csv(path, usecols=["Date", "Sensor_ID"], chunksize=CHUNK_ROWS):
+        chunk["Date"] = pd.to_datetime(chunk["Date"], errors="coerce", utc=True)
+        update_watermarks(watermarks, chunk.dropna(subset=["Date"]))
+    return watermarks
+
+
+def stream_floor(watermarks: dict, default=None, lateness_days: int = LATENESS_DAYS):
+    """Date de début du flux : le plus ancien watermark, borné à ``lateness_days`` avant le plus récent"""
+    if not watermarks:
+        return default
+    newest = max(wm["last_date"] for wm in watermarks.values())
+    bound = newest - pd.Timedelta(days=lateness_days)
+    stale = sorted(sensor for sensor, wm in watermarks.items() if wm["last_date"] < bound)
+    if stale:
+        print(f"⚠️ {len(stale)} capteur(s) en retard de plus de {lateness_days} jours ignorés pour borner le flux : {', '.join(stale)}")
+    return max(min(wm["last_date"] for wm in watermarks.values()), bound)
+
+
+def update_watermarks(watermarks: dict, df: pd.DataFrame):
+    """Avance les watermarks avec les lignes ingérées (max Date, nombre de lignes)"""
+    if df.empty:
+        return watermarks
+    stats = df.groupby(df["Sensor_ID"].astype(str))["Date"].agg(["max", "size"])
+    for sensor, row in stats.iterrows():
+        wm = watermarks.get(sensor)
+        if wm is None:
+            watermarks[sensor] = {"last_date": row["max"], "rows": int(row["size"])}
+        else:
+            wm["last_date"] = max(wm["last_date"], row["max"])
+            wm["rows"] += int(row["size"])
+    return watermarks
+
+
+def filter_new_rows(df: pd.DataFrame, watermarks: dict, default=None):
+    """Garde les lignes plus récentes que le watermark de leur capteur.
+
+    Un capteur inconnu du manifeste utilise ``default`` (ou garde toutes ses lignes).
+    """
+    if df.empty:
+        return df
+    per_sensor = pd.Series({sensor: wm["last_date"] for sensor, wm in watermarks.items()}, dtype="datetime64[ns, UTC]")
+    last_dates = df["Sensor_ID"].astype(str).map(per_sensor)
+    if default is not None:
+        last_dates = last_dates.fillna(default)
+    return df[last_dates.isna() | (df["Date"] > last_dates)]
+
+
+def _delta_entry(key: str, df: pd.DataFrame):
+    """Résumé d'un delta pour le manifeste S3"""
+    dates = pd.to_datetime(df["Date"], errors="coerce", utc=True)
+    return {
+        "key": key,
+        "rows": int(len(df)),
+        "min_date": dates.min().isoformat() if dates.notna().any() else None,
+        "max_date": dates.max().isoformat() if dates.notna().any() else None,
+    }
+
+
+def load_s3_manifest(s3, bucket_name, prefix="bike/"):
+    """Lit le manifeste des deltas (un seul petit GET), ou None s'il n'existe pas"""
+    try:
+        obj = s3.get_object(Bucket=bucket_name, Key=f"{prefix}{S3_MANIFEST_NAME}")
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(obj["Body"].read())
+
+
+def save_s3_manifest(s3, bucket_name, manifest, prefix="bike/"):
+    """Remplace le manifeste en un seul PUT (atomique côté S3)"""
+    manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=f"{prefix}{S3_MANIFEST_NAME}",
+        Body=json.dumps(manifest, indent=2).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def rebuild_s3_manifest(s3, bucket_name, prefix="bike/"):
+    """Reconstruit le manifeste en listant tous les deltas (pagination complète)"""
+    print("🔁 Manifeste S3 absent : reconstruction par listage des deltas...")
+    deltas = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith(S3_MANIFEST_NAME) or not is_delta_key(key):
+                continue
+            body = s3.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+            df = read_delta(body, key, columns=["Date"])
+            if "Date" in df.columns:
+                deltas.append(_delta_entry(key, df))
+    manifest = {"deltas": deltas}
+    save_s3_manifest(s3, bucket_name, manifest, prefix=prefix)
+    print(f"📦 Manifeste reconstruit : {len(deltas)} deltas.")
+    return manifest
+
+
+def record_delta_in_s3_manifest(bucket_name, key, df, prefix="bike/"):
+    """Ajoute un delta uploadé au manifeste S3"""
+    s3 = boto3.client("s3")
+    manifest = load_s3_manifest(s3, bucket_name, prefix=prefix)
+    if manifest is None:
+        manifest = rebuild_s3_manifest(s3, bucket_name, prefix=prefix)
+    manifest["deltas"] = [d for d in manifest.get("deltas", []) if d["key"] != key]
+    manifest["deltas"].append(_delta_entry(key, df))
+    save_s3_manifest(s3, bucket_name, manifest, prefix=prefix)
+    print(f"📦 Manifeste S3 mis à jour ({len(manifest['deltas'])} deltas).")
+
+
 def get_latest_date_from_s3(bucket_name, prefix="bike/"):
-    """Récupère la dernière date de données présente sur S3"""
+    """Récupère la dernière date de données présente sur S3 (via le manifeste des deltas)"""
     s3 = boto3.client("s3")
     try:
-        objects = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-        if "Contents" not in objects:
-            print("📭 Aucun fichier trouvé dans S3.")
-            return None
+        manifest = load_s3_manifest(s3, bucket_name, prefix=prefix)
+        if manifest is None:
+            manifest = rebuild_s3_manifest(s3, bucket_name, prefix=prefix)
 
-        latest_file = max(objects["Contents"], key=lambda x: x["LastModified"])["Key"]
-        print(f"📦 Dernier fichier S3 détecté : {latest_file}")
+        max_dates = [d["max_date"] for d in manifest.get("deltas", []) if d.get("max_date")]
+        if not max_dates:
+            print("📭 Aucun delta trouvé dans S3.")
+            return None
 
-        csv_obj = s3.get_object(Bucket=bucket_name, Key=latest_file)
-        df_last = pd.read_csv(csv_obj["Body"])
-        if "Date" in df_last.columns:
-            last_date = pd.to_datetime(df_last["Date"], utc=True).max()
-            print(f"🕓 Dernière date trouvée dans S3 : {last_date}")
-            return last_date
-        return None
+        last_date = max(pd.Timestamp(d) for d in max_dates)
+        print(f"🕓 Dernière date trouvée dans S3 : {last_date}")
+        return last_date
     except Exception as e:
         print("⚠️ Erreur S3 :", e)
         return None
 
 
-def upload_to_s3(df: pd.DataFrame, bucket_name: str, file_name: str):
-    """Charge un fichier CSV sur S3"""
-    s3 = boto3.client("s3")
-    csv_buffer = StringIO()
-    df.to_csv(csv_buffer, index=False)
-    s3.put_object(Bucket=bucket_name, Key=file_name, Body=csv_buffer.getvalue())
-    print(f"✅ Fichier envoyé : s3://{bucket_name}/{file_name}")
+def upload_to_s3(df: pd.DataFrame, bucket_name: str, key_base: str, fmt: str = OUTPUT_FORMAT):
+    """Charge un delta sur S3 (Parquet, CSV gzip ou CSV) et renvoie sa clé"""
+    return write_delta(
+        df, bucket_name, key_base, fmt=fmt,
+        schema=DELTA_SCHEMA, compression=PARQUET_COMPRESSION,
+    )
 
 
 
 def main():
     print("============== 🌆 DÉBUT DU BATCH CITYFLOW ==============")
 
-    # Étape 1 — Télécharger les données
-    data = download_data(DATA_URL)
-    if not data:
-        print("❌ Téléchargement échoué, arrêt du batch.")
-        return
-
-    # Étape 2 — Charger et nettoyer
-    df = load_data(data)
-    df_cleaned = clean_data(df)
+    # Étape 1 — Charger les watermarks par capteur
+    watermarks = load_watermarks()
+    if not watermarks:
+        watermarks = watermarks_from_reference()
+        if watermarks:
+            save_watermarks(watermarks)
 
-    # Étape 3 — Déterminer la dernière date
     latest_date = None
-    if os.path.exists(LOCAL_REFERENCE_FILE):
-        existing = pd.read_csv(LOCAL_REFERENCE_FILE)
-        latest_date = pd.to_datetime(existing["Date"], utc=True).max()
-        print(f"🕓 Dernière date locale connue : {latest_date}")
-    else:
+    if not watermarks:
         latest_date = get_latest_date_from_s3(S3_BUCKET_NAME, prefix=S3_PREFIX)
-
-    # Étape 4 — Filtrer les nouvelles données
-    if latest_date is not None:
-        new_data = df_cleaned[df_cleaned["Date"] > latest_date]
+        if latest_date is not None and pd.isna(latest_date):
+            latest_date = None
+
+    # Étape 2 — Télécharger, charger et nettoyer
+    if STREAMING_MODE:
+        # Le plus ancien watermark borne le flux (dans la limite de LATENESS_DAYS)
+        since = START_DATE
+        floor = stream_floor(watermarks, default=latest_date)
+        if floor is not None:
+            since = max(START_DATE, floor.to_pydatetime())
+        df_cleaned = http_cache = None
+        if INCREMENTAL_FETCH:
+            df_cleaned, http_cache = fetch_incremental(since)
+        if df_cleaned is None:
+            df_cleaned = stream_data(DATA_URL, since=since)
+        if df_cleaned is None:
+            print("❌ Téléchargement échoué, arrêt du batch.")
+            return
     else:
-        new_data = df_cleaned
+        http_cache = None
+        data = download_data(DATA_URL)
+        if not data:
+            print("❌ Téléchargement échoué, arrêt du batch.")
+            return
+        df = load_data(data)
+        df_cleaned = clean_data(df)
+
+    # Étape 3 — Filtrer les nouvelles données (par capteur)
+    new_data = filter_new_rows(df_cleaned, watermarks, default=latest_date)
 
     if new_data.empty:
+        if http_cache:
+            save_http_cache(http_cache)
         print("ℹ️ Aucune nouvelle donnée à charger.")
         print("============== ✅ FIN DU BATCH (aucune mise à jour) ==============")
         return
 
-    # Étape 5 — Mettre à jour le fichier local
-    if os.path.exists(LOCAL_REFERENCE_FILE):
-        combined = pd.concat([existing, new_data]).drop_duplicates(subset=["Date", "Sensor_ID"])
-    else:
-        combined = new_data
-    combined.to_csv(LOCAL_REFERENCE_FILE, index=False)
-    print(f"💾 Fichier local mis à jour : {LOCAL_REFERENCE_FILE}")
-
-    # Étape 6 — Envoi sur S3
+    # Étape 4 — Envoi sur S3 et avancée des watermarks
     timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M")
-    s3_key = f"{S3_PREFIX}cleaned_data_delta_{timestamp}.csv"
-    upload_to_s3(new_data, S3_BUCKET_NAME, s3_key)
+    s3_key = upload_to_s3(new_data, S3_BUCKET_NAME, f"{S3_PREFIX}cleaned_data_delta_{timestamp}")
+    record_delta_in_s3_manifest(S3_BUCKET_NAME, s3_key, new_data, prefix=S3_PREFIX)
+
+    save_watermarks(update_watermarks(watermarks, new_data))
+
+    # Étape 5 — Ajouter le delta au fichier local, une fois chargé, avec l'en-tête existant
+    append_to_reference(new_data)
+
+    # Validateurs HTTP enregistrés seulement une fois le delta chargé : un échec rejoue la requête
+    if http_cache:
+        save_http_cache(http_cache)
 
     print(f"📈 {len(new_data)} nouvelles lignes envoyées.")
     print("============== ✅ FIN DU BATCH CITYFLOW ==============")
@@ -1,53 +1,219 @@
+import hashlib
+import json
 import os
+from datetime import datetime, timezone
 from io import BytesIO
-from decimal import Decimal
 
 import boto3
 import pandas as pd
+from botocore.exceptions import ClientError
 import pyarrow as pa
 import pyarrow.parquet as pq
 
+from catalog import write_entry
+from ddb_bulk import DigestStore, bulk_put, items_from_columns
+from s3_reader import list_objects, read_tables
+
 S3 = boto3.client("s3")
-DDB = boto3.resource("dynamodb")
 
 BUCKET = os.environ.get("BUCKET", "cityflow-raw0")
+SILVER_PREFIX = os.environ.get("SILVER_PREFIX", "silver/")
 GOLD_PREFIX = os.environ.get("GOLD_PREFIX", "gold/")
+ROLLUP_PREFIX = os.environ.get("ROLLUP_PREFIX", "rollups/bike/")
+STATE_PREFIX = os.environ.get("STATE_PREFIX", "state/bike/")
 DDB_TABLE = os.environ.get("DDB_TABLE", "TrafficAggregated")
+DIGEST_PREFIX = os.environ.get("DIGEST_PREFIX", "state/ddb-digests/")
+COMPACT_MIN_PARTS = int(os.environ.get("COMPACT_MIN_PARTS", 24))  # compact once a day has this many parts
+STATE_RETRIES = int(os.environ.get("STATE_RETRIES", 5))  # attempts when another invocation updates the same day
+
+STATE_KEYS = ["Location_Name", "day"]
+
+def _state_key(day):
+    return f"{STATE_PREFIX}date={day}/partial.parquet"
+
+class StateConflict(Exception):
+    """Another invocation updated the day's state (or its parts) since it was loaded."""
+
+def _empty_state():
+    return pd.DataFrame(columns=STATE_KEYS + ["total_counts", "n_counts"]), set(), {}
+
+def load_state(day):
+    """Sum/count state, merged parts, compacted parts -> absorbed keys, and the state's ETag."""
+    try:
+        obj = S3.get_object(Bucket=BUCKET, Key=_state_key(day))
+    except S3.exceptions.NoSuchKey:
+        return (*_empty_state(), None)
+    table = pq.read_table(BytesIO(obj["Body"].read()))
+    metadata = table.schema.metadata or {}
+    parts = json.loads(metadata.get(b"parts", b"[]"))
+    compacted = json.loads(metadata.get(b"compacted", b"{}"))
+    return table.to_pandas(), set(parts), {k: set(v) for k, v in compacted.items()}, obj["ETag"]
+
+def save_state(day, state, parts, compacted, etag):
+    """Write the state only if it is still at ``etag`` (None: not created yet); returns the new ETag."""
+    table = pa.Table.from_pandas(state, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"parts"] = json.dumps(sorted(parts)).encode("utf-8")
+    metadata[b"compacted"] = json.dumps({k: sorted(v) for k, v in compacted.items()}).encode("utf-8")
+    metadata[b"updated_at"] = datetime.now(timezone.utc).isoformat().encode("utf-8")
+    buf = BytesIO()
+    pq.write_table(table.replace_schema_metadata(metadata), buf)
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    try:
+        return S3.put_object(Bucket=BUCKET, Key=_state_key(day), Body=buf.getvalue(), **condition)["ETag"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+            raise StateConflict(f"state of {day} changed concurrently") from e
+        raise
+
+def _read_parts(objects):
+    try:
+        return read_tables(S3, BUCKET, objects).to_pandas()
+    except S3.exceptions.NoSuchKey as e:  # deleted by a concurrent compaction
+        raise StateConflict(str(e)) from e
+
+def partial_state(df):
+    """Sum and count of Counts per (Location_Name, day): mergeable by simple addition."""
+    return (
+        df.groupby(STATE_KEYS, as_index=False)
+          .agg(total_counts=("Counts", "sum"), n_counts=("Counts", "count"))
+    )
+
+def merge_state(state, partial):
+    if state.empty:
+        return partial
+    return (
+        pd.concat([state, partial], ignore_index=True)
+          .groupby(STATE_KEYS, as_index=False)
+          .agg(total_counts=("total_counts", "sum"), n_counts=("n_counts", "sum"))
+    )
+
+def _delete_keys(keys):
+    keys = sorted(keys)
+    for i in range(0, len(keys), 1000):  # delete_objects limit
+        S3.delete_objects(Bucket=BUCKET, Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]]})
+
+def compact(day, state, objects, parts, compacted, etag):
+    """Merge a day's parts into one sorted part (recorded in the state first), then delete them."""
+    df = _read_parts(objects).sort_values(["Location_Name", "Date"], kind="stable")
+    merged = {obj["Key"] for obj in objects}
+    digest = hashlib.blake2b("\n".join(sorted(merged)).encode("utf-8"), digest_size=16).hexdigest()
+    key = f"{SILVER_PREFIX}date={day}/part-compact-{digest}.parquet"
+    absorbed = set(merged)
+    for k in merged:
+        absorbed |= compacted.get(k, set())
+    compacted = {**compacted, key: absorbed - {key}}
+    etag = save_state(day, state, parts | {key}, compacted, etag)
+    buf = BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buf)
+    S3.put_object(Bucket=BUCKET, Key=key, Body=buf.getvalue())
+
+    _delete_keys(merged - {key})
+    print(f"[AGG] Compacted {len(merged)} parts into s3://{BUCKET}/{key}")
+    return (parts - merged) | {key}, compacted, etag
+
+def drop_redelivered(objects, compacted):
+    """Delete listed parts already absorbed by a written compacted part; returns the others."""
+    listed = {obj["Key"] for obj in objects}
+    stale = set()
+    for key, absorbed in compacted.items():
+        if key in listed:  # compacted part written: anything it absorbed is a duplicate
+            stale |= absorbed & listed
+    if stale:
+        _delete_keys(stale)
+        print(f"[AGG] Dropped {len(stale)} redelivered part(s) already compacted")
+    return [obj for obj in objects if obj["Key"] not in stale]
 
 def lambda_handler(event, context):
-    silver_key = event.get("silver_key")
     day = event.get("day")
-    if not silver_key or not day:
-        raise ValueError("silver_key and day are required")
+    if not day:
+        raise ValueError("day is required")
+    rebuild = bool(event.get("rebuild"))
 
-    print(f"[AGG] Input: s3://{BUCKET}/{silver_key} (day={day})")
+    # Optimistic concurrency: a conflicting state write restarts from the latest state, and
+    # outputs are rewritten if another invocation saved the state after this one
+    refresh = False
+    for attempt in range(1, STATE_RETRIES + 1):
+        try:
+            result = aggregate_day(day, rebuild, refresh)
+        except StateConflict as e:
+            print(f"[AGG] Attempt {attempt}: {e}, retrying")
+            refresh = True
+            continue
+        if result.get("etag") is None or _state_etag(day) == result["etag"]:
+            return {k: v for k, v in result.items() if k != "etag"}
+        print(f"[AGG] Attempt {attempt}: state of {day} updated meanwhile, refreshing outputs")
+        refresh = True
+    raise RuntimeError(f"Could not update the state of {day} after {STATE_RETRIES} attempts")
 
-    obj = S3.get_object(Bucket=BUCKET, Key=silver_key)
-    df = pq.read_table(BytesIO(obj["Body"].read())).to_pandas()
+def _state_etag(day):
+    try:
+        return S3.head_object(Bucket=BUCKET, Key=_state_key(day))["ETag"]
+    except ClientError:
+        return None
 
-    grp = (
-        df.groupby(["Location_Name", "day"], as_index=False)
-          .agg(total_counts=("Counts", "sum"),
-               avg_counts=("Counts", "mean"))
-    )
+def aggregate_day(day, rebuild=False, refresh=False):
+    """One aggregation pass for a day; raises StateConflict if the state moved underneath."""
+    # ---- Merge new silver parts into the day's partial state ----
+    objects = list_objects(S3, BUCKET, f"{SILVER_PREFIX}date={day}/", extensions=(".parquet",))
+    state, parts, compacted, etag = load_state(day)
+    objects = drop_redelivered(objects, compacted)
+    if rebuild:
+        state, parts, _ = _empty_state()
+    saved = False
+    listed = {obj["Key"] for obj in objects}
+    parts &= listed  # forget parts removed by a compaction
+    # A compaction that crashed before writing its part is simply forgotten (and redone)
+    compacted = {k: v for k, v in compacted.items() if k in listed}
+    new = [obj for obj in objects if obj["Key"] not in parts]
+    print(f"[AGG] day={day}: {len(objects)} silver parts, {len(new)} new{' (rebuild)' if rebuild else ''}")
+
+    if new or rebuild:
+        df = _read_parts(new) if new else pd.DataFrame()
+        if not df.empty:
+            state = merge_state(state, partial_state(df))
+        parts |= {obj["Key"] for obj in new}
+        etag = save_state(day, state, parts, compacted, etag)
+        saved = True
+
+    # ---- Compact small parts (optional, state is unchanged) ----
+    if len(objects) >= COMPACT_MIN_PARTS:
+        parts, compacted, etag = compact(day, state, objects, parts, compacted, etag)
+        saved = True
 
-    # ---- Write Gold ----
+    if not new and not rebuild and not refresh:
+        print("[AGG] Nothing new to aggregate")
+        return {"ok": True, "rows": len(state), "new_parts": 0, "etag": etag if saved else None}
+
+    grp = state.assign(avg_counts=state["total_counts"] / state["n_counts"])
+
+    # ---- Write Gold (rebuilt from the small state, not from silver) ----
     gold_key = f"{GOLD_PREFIX}date={day}/aggregated.parquet"
     buf = BytesIO()
-    pq.write_table(pa.Table.from_pandas(grp), buf)
+    pq.write_table(pa.Table.from_pandas(grp[STATE_KEYS + ["total_counts", "avg_counts"]], preserve_index=False), buf)
     S3.put_object(Bucket=BUCKET, Key=gold_key, Body=buf.getvalue())
     print(f"[AGG] Wrote: s3://{BUCKET}/{gold_key}")
 
-    # ---- Upsert DynamoDB ----
-    table = DDB.Table(DDB_TABLE)
-    with table.batch_writer(overwrite_by_pkeys=["Location_Name", "Date"]) as batch:
-        for _, r in grp.iterrows():
-            batch.put_item(Item={
-                "Location_Name": str(r["Location_Name"]),
-                "Date": str(r["day"]),
-                "total_counts": Decimal(str(r["total_counts"])),
-                "avg_counts": Decimal(str(r["avg_counts"])),
-            })
-    print(f"[AGG] Upserted {len(grp)} items into {DDB_TABLE}")
-
-    return {"ok": True, "gold_key": gold_key, "rows": len(grp)}
+    # ---- Write the compact daily rollup read by multi-day reports ----
+    rollup_key = f"{ROLLUP_PREFIX}date={day}/rollup.parquet"
+    buf = BytesIO()
+    pq.write_table(pa.Table.from_pandas(state[["Location_Name", "total_counts", "n_counts"]], preserve_index=False), buf)
+    S3.put_object(Bucket=BUCKET, Key=rollup_key, Body=buf.getvalue())
+
+    # ---- Catalog: exact row count for the day ----
+    write_entry(S3, BUCKET, "bike", day, rows=int(state["n_counts"].sum()), locations=len(state))
+
+    # ---- Upsert DynamoDB (unchanged locations are skipped via digests) ----
+    items = items_from_columns({
+        "Location_Name": grp["Location_Name"].astype(str),
+        "Date": grp["day"].astype(str),
+        "total_counts": grp["total_counts"].astype(float),
+        "avg_counts": grp["avg_counts"].astype(float),
+    })
+    digest_store = DigestStore(S3, BUCKET, f"{DIGEST_PREFIX}{DDB_TABLE}/date={day}.json")
+    digests = {} if rebuild else digest_store.load()
+    stats = bulk_put(DDB_TABLE, items, key_attrs=["Location_Name", "Date"], digests=digests)
+    digest_store.save(digests)
+    print(f"[AGG] Upserted {stats['written']} items into {DDB_TABLE} ({stats['skipped']} unchanged)")
+
+    return {"ok": True, "gold_key": gold_key, "rows": len(grp), "new_parts": len(new), "etag": etag}
@@ -0,0 +1,94 @@
+import heapq
+import re
+from decimal import Decimal
+
+# Agrégations supportées par le mode ?group_by=...&metric=...&agg=...
+AGGS = ("mean", "sum", "max", "min", "count")
+MAX_TOP = 1000
+
+_FIELD = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _field(name, param):
+    name = str(name).strip()
+    if not _FIELD.match(name):
+        raise ValueError(f"{param} invalide : {name}")
+    return name
+
+
+def parse_aggregation(params):
+    """Lit group_by / metric / agg / top ; None si le mode agrégation n'est pas demandé."""
+    if not params.get("group_by"):
+        return None
+    group_by = [_field(g, "group_by") for g in str(params["group_by"]).split(",") if g.strip()]
+    agg = str(params.get("agg") or "mean").strip().lower()
+    if agg not in AGGS:
+        raise ValueError(f"agg inconnu : {agg} (attendu : {', '.join(AGGS)})")
+    metric = _field(params["metric"], "metric") if params.get("metric") else None
+    if metric is None and agg != "count":
+        raise ValueError(f"metric requis pour agg={agg}")
+    top = None
+    if params.get("top"):
+        top = int(params["top"])
+        if top <= 0:
+            raise ValueError("top doit être > 0")
+        top = min(top, MAX_TOP)
+    return {"group_by": group_by, "metric": metric, "agg": agg, "top": top}
+
+
+def aggregation_fields(aggregation):
+    """Attributs à projeter : seules les clés de groupe et la métrique sont lues."""
+    return list(dict.fromkeys(aggregation["group_by"] + ([aggregation["metric"]] if aggregation["metric"] else [])))
+
+
+def _number(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def aggregate_items(items, aggregation):
+    """Réduit les items en un passage (accumulateurs par groupe), puis top-K éventuel via heapq.
+
+    Renvoie une ligne par groupe : clés de groupe, valeur agrégée (colonne ``metric``) et ``n``
+    (nombre de valeurs prises en compte) ; avec agg=count, une seule colonne ``count``.
+    """
+    group_by, metric, agg, top = (aggregation[k] for k in ("group_by", "metric", "agg", "top"))
+    acc = {}  # clé -> [n, somme, min, max]
+    for item in items:
+        key = tuple(item.get(g) for g in group_by)
+        state = acc.get(key)
+        if state is None:
+            state = acc[key] = [0, 0.0, None, None]
+        if metric is None:
+            state[0] += 1
+            continue
+        value = _number(item.get(metric))
+        if value is None or value != value:
+            continue
+        state[0] += 1
+        state[1] += value
+        state[2] = value if state[2] is None else min(state[2], value)
+        state[3] = value if state[3] is None else max(state[3], value)
+
+    def result(state):
+        n, total, low, high = state
+        if agg == "count":
+            return n
+        if not n:
+            return None
+        return {"mean": total / n, "sum": total, "min": low, "max": high}[agg]
+
+    rows = [(result(state), key, state[0]) for key, state in acc.items()]
+    if top:
+        rows = heapq.nlargest(top, (r for r in rows if r[0] is not None), key=lambda r: r[0])
+    else:
+        rows.sort(key=lambda r: tuple("" if k is None else str(k) for k in r[1]))
+    if agg == "count":
+        return [{**dict(zip(group_by, key)), "count": value} for value, key, _ in rows]
+    return [{**dict(zip(group_by, key)), metric: value, "n": n} for value, key, n in rows]
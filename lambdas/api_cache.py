@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# ----------------------------
+# CONFIGURATION
+# ----------------------------
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_PAST_TTL_S = int(os.environ.get("CACHE_PAST_TTL_S", 24 * 3600))  # Jours clos : immuables
+CACHE_TODAY_TTL_S = int(os.environ.get("CACHE_TODAY_TTL_S", 60))       # Jour courant / sans date
+
+
+class ResponseCache:
+    """Cache LRU borné en octets, conservé entre les invocations d'un conteneur Lambda chaud."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, past_ttl=CACHE_PAST_TTL_S, today_ttl=CACHE_TODAY_TTL_S):
+        self.max_bytes = max_bytes
+        self.past_ttl = past_ttl
+        self.today_ttl = today_ttl
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # clé -> (expiration, taille, valeur)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(params):
+        """Clé normalisée : noms en minuscules, valeurs sans espaces, paramètres vides ignorés, ordre trié."""
+        normalized = sorted(
+            (str(k).strip().lower(), str(v).strip())
+            for k, v in (params or {}).items()
+            if v is not None and str(v).strip()
+        )
+        return "&".join(f"{k}={v}" for k, v in normalized)
+
+    def ttl_for(self, dates):
+        """TTL long si toutes les dates demandées sont closes (antérieures à aujourd'hui, UTC)."""
+        today = datetime.now(timezone.utc).date().isoformat()
+        if dates and all(d and str(d).strip() < today for d in dates):
+            return self.past_ttl
+        return self.today_ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, size, ttl):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time() + ttl, size, value)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size_bytes -= size
+
+    def headers(self, hit):
+        return {
+            "X-Cache": "HIT" if hit else "MISS",
+            "X-Cache-Hits": str(self.hits),
+            "X-Cache-Misses": str(self.misses),
+        }
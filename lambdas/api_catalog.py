@@ -0,0 +1,54 @@
+import json
+import os
+import boto3
+import logging
+
+from api_cache import ResponseCache
+from api_response import error, finalize
+from catalog import read_catalog
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client('s3')
+BUCKET = os.environ.get("BUCKET", "cityflow-raw0")
+
+# Jeux de données exposés (entrées écrites par clean/aggregate vélo et le job trafic)
+DATASETS = ("bike", "traffic")
+
+# Le catalogue change à chaque écriture : TTL court, mais la plupart des appels restent en cache
+CATALOG_TTL_S = int(os.environ.get("CATALOG_TTL_S", 60))
+CACHE = ResponseCache(past_ttl=CATALOG_TTL_S, today_ttl=CATALOG_TTL_S)
+
+def lambda_handler(event, context):
+    try:
+        params = event.get('queryStringParameters') or {}
+
+        requested = [d.strip() for d in str(params.get('dataset') or ",".join(DATASETS)).split(",") if d.strip()]
+        unknown = [d for d in requested if d not in DATASETS]
+        if unknown:
+            return error(400, f"dataset inconnu : {', '.join(unknown)} (attendu : {', '.join(DATASETS)})")
+
+        cache_key = CACHE.key({"dataset": ",".join(sorted(requested))})
+        cached = CACHE.get(cache_key)
+        if cached is not None:
+            return finalize(event, {**cached, "headers": {**cached["headers"], **CACHE.headers(hit=True)}})
+
+        datasets = {name: read_catalog(s3, BUCKET, name) for name in requested}
+        # Dates disponibles dans au moins un jeu de données, de la plus récente à la plus ancienne
+        dates = sorted({e["day"] for entries in datasets.values() for e in entries if e.get("rows")}, reverse=True)
+
+        response = {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"dates": dates, "datasets": datasets}, ensure_ascii=False),
+        }
+        CACHE.put(cache_key, response, len(response["body"]), CATALOG_TTL_S)
+        return finalize(event, {**response, "headers": {**response["headers"], **CACHE.headers(hit=False)}})
+
+    except Exception as e:
+        logger.exception("Erreur Lambda catalogue")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
@@ -0,0 +1,192 @@
+import base64
+import gzip
+import hashlib
+import io
+import json
+from datetime import date, timedelta
+from decimal import Decimal
+
+GZIP_MIN_BYTES = 1024  # En dessous, la compression ne vaut pas son coût
+
+# Formats de réponse négociables (?format= ou en-tête Accept)
+FORMATS = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "csv": "text/csv",
+}
+
+
+def json_default(obj):
+    """Sérialise les Decimal DynamoDB sans reparcourir les items (hook de json.dumps)."""
+    if isinstance(obj, Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    raise TypeError(f"Type non sérialisable : {type(obj).__name__}")
+
+
+def is_truthy(value):
+    return str(value or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def parse_fields(value):
+    """?fields=a,b,c -> ["a", "b", "c"] (None si absent)."""
+    fields = [f.strip() for f in str(value or "").split(",") if f.strip()]
+    return fields or None
+
+
+def parse_limit(value, max_limit):
+    if not value:
+        return None
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError("limit doit être > 0")
+    return min(limit, max_limit)
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"date invalide : {value} (attendu : AAAA-MM-JJ)")
+
+
+def parse_dates(params, max_dates):
+    """Dates demandées : ?date=, ?dates=a,b,c ou ?date_from=&date_to= (bornes incluses).
+
+    Renvoie une liste triée de dates ISO, ou [None] si aucun filtre de date n'est donné.
+    """
+    if params.get("date_from") or params.get("date_to"):
+        start = _parse_date(params.get("date_from") or params.get("date_to"))
+        end = _parse_date(params.get("date_to") or params.get("date_from"))
+        if start > end:
+            raise ValueError(f"date_from ({start}) postérieure à date_to ({end})")
+        if (end - start).days + 1 > max_dates:
+            raise ValueError(f"plage trop longue : {max_dates} jours maximum")
+        return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+    if params.get("dates"):
+        dates = sorted({_parse_date(d).isoformat() for d in str(params["dates"]).split(",") if d.strip()})
+        if len(dates) > max_dates:
+            raise ValueError(f"trop de dates : {max_dates} maximum")
+        return dates or [None]
+    if params.get("date"):
+        return [str(params["date"]).strip()]
+    return [None]
+
+
+def _request_header(event, name):
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value or ""
+    return ""
+
+
+def negotiate_format(params, event):
+    """?format= prioritaire, sinon premier type de l'en-tête Accept reconnu, sinon JSON."""
+    fmt = str(params.get("format") or "").strip().lower()
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"format inconnu : {fmt} (attendu : {', '.join(FORMATS)})")
+        return fmt
+    for accepted in _request_header(event, "accept").lower().split(","):
+        media_type = accepted.split(";")[0].strip()
+        for name, content_type in FORMATS.items():
+            if media_type == content_type:
+                return name
+    return "json"
+
+
+def _arrow_column(values):
+    """Colonne typée à partir des valeurs DynamoDB ou agrégées (Decimal/float -> int64 ou float64)."""
+    import pyarrow as pa
+
+    kinds = {type(v) for v in values if v is not None}
+    if kinds and kinds <= {Decimal, int, float}:
+        if float not in kinds and all(v is None or v % 1 == 0 for v in values):
+            return pa.array([None if v is None else int(v) for v in values], type=pa.int64())
+        return pa.array([None if v is None else float(v) for v in values], type=pa.float64())
+    if kinds == {bool}:
+        return pa.array(values, type=pa.bool_())
+    if kinds <= {str}:
+        return pa.array(values, type=pa.string())
+    return pa.array([None if v is None else json.dumps(v, default=json_default) if isinstance(v, (dict, list))
+                     else str(v) for v in values], type=pa.string())
+
+
+def items_to_arrow(items):
+    """Construit une table Arrow colonne par colonne directement depuis les items DynamoDB."""
+    # Import local : pyarrow n'est chargé que pour les formats colonnaires
+    import pyarrow as pa
+
+    names = list(dict.fromkeys(name for item in items for name in item))
+    return pa.table({name: _arrow_column([item.get(name) for item in items]) for name in names})
+
+
+def encode_items(items, fmt):
+    """Sérialise les items au format colonnaire demandé. Renvoie (corps, base64 ?)."""
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+
+    table = items_to_arrow(items)
+    buf = io.BytesIO()
+    if fmt == "arrow":
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        with pa.ipc.new_stream(buf, table.schema, options=options) as writer:
+            writer.write_table(table)
+    elif fmt == "parquet":
+        pq.write_table(table, buf, compression="zstd")
+    elif fmt == "csv":
+        if table.num_columns:
+            pacsv.write_csv(table, buf)
+        return buf.getvalue().decode("utf-8"), False
+    else:
+        raise ValueError(f"format non colonnaire : {fmt}")
+    return base64.b64encode(buf.getvalue()).decode("ascii"), True
+
+
+def etag_for(body):
+    """ETag faible dérivé du corps non compressé (identique quelle que soit la compression)."""
+    raw = body.encode("utf-8") if isinstance(body, str) else body
+    return f'W/"{hashlib.blake2b(raw, digest_size=16).hexdigest()}"'
+
+
+def finalize(event, response):
+    """Ajoute l'ETag (304 si If-None-Match correspond), puis compresse en gzip si le client l'accepte.
+
+    Le gzip est renvoyé en base64, comme l'attend une réponse proxy API Gateway.
+    """
+    body = response.get("body")
+    if body and response.get("statusCode") == 200:
+        etag = etag_for(body)
+        headers = {**response.get("headers", {}), "ETag": etag}
+        response = {**response, "headers": headers}
+        if etag in [tag.strip() for tag in _request_header(event, "if-none-match").split(",")]:
+            # Le client a déjà ce contenu : ni corps ni recalcul de compression
+            return {
+                "statusCode": 304,
+                "headers": {k: v for k, v in headers.items() if k != "Content-Type"},
+                "body": "",
+            }
+    if (
+        not body
+        or response.get("isBase64Encoded")
+        or "gzip" not in _request_header(event, "accept-encoding").lower()
+    ):
+        return response
+    raw = body.encode("utf-8") if isinstance(body, str) else body
+    if len(raw) < GZIP_MIN_BYTES:
+        return response
+    return {
+        **response,
+        "headers": {**response.get("headers", {}), "Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+        "body": base64.b64encode(gzip.compress(raw, compresslevel=6)).decode("ascii"),
+        "isBase64Encoded": True,
+    }
+
+
+def error(status, message):
+    return {
+        "statusCode": status,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"error": message}),
+    }
@@ -1,7 +1,15 @@
 import json
+import os
 import boto3
 import logging
-from decimal import Decimal
+
+from api_aggregate import aggregate_items, aggregation_fields, parse_aggregation
+from api_cache import ResponseCache
+from api_response import (
+    FORMATS, encode_items, error, finalize, is_truthy, json_default, negotiate_format, parse_dates, parse_fields,
+    parse_limit,
+)
+from ddb_query import check_cursor, decode_cursor, encode_cursor, query_dates
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -10,61 +18,94 @@ dynamodb = boto3.resource('dynamodb')
 TABLE_NAME = 'stats-jours-trafic'
 table = dynamodb.Table(TABLE_NAME)
 
-def decimal_to_native(obj):
-    if isinstance(obj, list):
-        return [decimal_to_native(i) for i in obj]
-    if isinstance(obj, dict):
-        return {k: decimal_to_native(v) for k, v in obj.items()}
-    if isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    return obj
+# Index utilisables pour les filtres (GSI sur la date)
+INDEXES = [
+    {"name": os.environ.get("DATE_INDEX", "date-index"), "pk": "date"},
+]
+
+MAX_LIMIT = int(os.environ.get("MAX_LIMIT", 1000))
+MAX_DATES = int(os.environ.get("MAX_DATES", 31))  # Dates max par requête (dates= ou date_from/date_to)
+
+# Cache des réponses, conservé entre invocations tant que le conteneur reste chaud
+CACHE = ResponseCache()
 
 def lambda_handler(event, context):
     try:
         logger.info("Event: %s", json.dumps(event))
 
         params = event.get('queryStringParameters') or {}
-        date = params.get('date')
+
+        try:
+            fmt = negotiate_format(params, event)
+        except ValueError as e:
+            return error(400, str(e))
+
+        cache_key = CACHE.key({**params, "format": fmt})
+        cached = CACHE.get(cache_key)
+        if cached is not None:
+            return finalize(event, {**cached, "headers": {**cached["headers"], **CACHE.headers(hit=True)}})
+
         departement = params.get('departement')
         niveau_congestion = params.get('niveau_congestion')
         nom_rue = params.get('nom_rue')
 
-        response = table.scan()
-        items = response.get('Items', [])
-        total_before = len(items)
-
-        # 🛠 Filtrage PROPRE et FIABLE
-        def equals(a, b):
-            if not a or not b:
-                return False
-            return str(a).strip().lower() == str(b).strip().lower()
-
-        if date:
-            items = [i for i in items if equals(i.get('date'), date)]
-        if departement:
-            items = [i for i in items if equals(i.get('departement'), departement)]
-        if niveau_congestion:
-            items = [i for i in items if equals(i.get('niveau_congestion'), niveau_congestion)]
-        if nom_rue:
-            items = [i for i in items if equals(i.get('nom_rue'), nom_rue)]
-
-        items_native = decimal_to_native(items)
-        total_after = len(items_native)
-
-        debug = {
-            "received_query_params": params,
-            "total_items_in_table": total_before,
-            "total_items_after_filter": total_after,
-            "sample_items_after_filter": items_native[:3]
+        try:
+            dates = parse_dates(params, MAX_DATES)
+            limit = parse_limit(params.get('limit'), MAX_LIMIT)
+            start_key = decode_cursor(params.get('cursor'))
+            check_cursor(start_key, dates)
+            aggregation = parse_aggregation(params)
+        except ValueError as e:
+            return error(400, str(e))
+
+        filters = {
+            "departement": departement,
+            "niveau_congestion": niveau_congestion,
+            "nom_rue": nom_rue,
         }
+        if aggregation:
+            # Mode agrégation : lecture projetée sur les stats journalières, réduction côté serveur
+            items, stats = query_dates(table, filters, "date", dates, INDEXES, fields=aggregation_fields(aggregation))
+            items = aggregate_items(items, aggregation)
+        else:
+            items, stats = query_dates(table, filters, "date", dates, INDEXES,
+                                       fields=parse_fields(params.get('fields')), limit=limit, start_key=start_key)
 
-        logger.info("DEBUG: %s", json.dumps(debug, ensure_ascii=False))
+        next_cursor = encode_cursor(stats["last_key"])
 
-        return {
-            "statusCode": 200,
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps({"debug": debug, "items": items_native}, ensure_ascii=False)
-        }
+        if fmt != "json":
+            # Formats colonnaires : curseur et nombre de lignes passent en en-têtes
+            body, is_binary = encode_items(items, fmt)
+            headers = {"Content-Type": FORMATS[fmt], "X-Count": str(len(items))}
+            if next_cursor:
+                headers["X-Next-Cursor"] = next_cursor
+            response = {"statusCode": 200, "headers": headers, "body": body, "isBase64Encoded": is_binary}
+        else:
+            payload = {
+                "items": items,
+                "count": len(items),
+                "next_cursor": next_cursor,
+            }
+
+            # Bloc debug uniquement sur demande explicite (?debug=1)
+            if is_truthy(params.get('debug')):
+                payload["debug"] = {
+                    "received_query_params": params,
+                    "access_path": stats["access_path"],
+                    "scanned_count": stats["scanned_count"],
+                    "total_items_after_filter": len(items),
+                    "sample_items_after_filter": items[:3]
+                }
+                logger.info("DEBUG: %s", json.dumps(payload["debug"], ensure_ascii=False, default=json_default))
+
+            response = {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(payload, ensure_ascii=False, default=json_default)
+            }
+
+        CACHE.put(cache_key, response, len(response["body"]), CACHE.ttl_for(dates))
+        return finalize(event, {**response, "headers": {**response["headers"], **CACHE.headers(hit=False)}})
 
     except Exception as e:
         logger.exception("Erreur Lambda")
@@ -1,7 +1,15 @@
 import json
+import os
 import boto3
 import logging
-from decimal import Decimal
+
+from api_aggregate import aggregate_items, aggregation_fields, parse_aggregation
+from api_cache import ResponseCache
+from api_response import (
+    FORMATS, encode_items, error, finalize, is_truthy, json_default, negotiate_format, parse_dates, parse_fields,
+    parse_limit,
+)
+from ddb_query import check_cursor, decode_cursor, encode_cursor, query_dates
 
 # Logging
 logger = logging.getLogger()
@@ -12,59 +20,127 @@ dynamodb = boto3.resource('dynamodb')
 TABLE_NAME = 'TrafficAggregated'
 table = dynamodb.Table(TABLE_NAME)
 
-def decimal_to_native(obj):
-    if isinstance(obj, list):
-        return [decimal_to_native(i) for i in obj]
-    if isinstance(obj, dict):
-        return {k: decimal_to_native(v) for k, v in obj.items()}
-    if isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    return obj
-
-def equals(a, b):
-    """Comparaison robuste (ignore espaces, casse, nulls)"""
-    if not a or not b:
-        return False
-    return str(a).strip().lower() == str(b).strip().lower()
+# Clé de la table (Location_Name, Date) + GSI sur la date
+INDEXES = [
+    {"name": None, "pk": "Location_Name", "sk": "Date"},
+    {"name": os.environ.get("DATE_INDEX", "Date-index"), "pk": "Date"},
+]
+
+MAX_LIMIT = int(os.environ.get("MAX_LIMIT", 1000))
+MAX_DATES = int(os.environ.get("MAX_DATES", 31))  # Dates max par requête (dates= ou date_from/date_to)
+
+# Sources de données : DynamoDB (défaut) ou lecture directe des Parquet gold via DuckDB (?source=lake)
+SOURCES = ("ddb", "lake")
+
+# Cache des réponses, conservé entre invocations tant que le conteneur reste chaud
+CACHE = ResponseCache()
 
 def lambda_handler(event, context):
     try:
         logger.info("EVENT RAW: %s", json.dumps(event))
 
         params = event.get('queryStringParameters') or {}
-        date = params.get('date')
+
+        try:
+            fmt = negotiate_format(params, event)
+        except ValueError as e:
+            return error(400, str(e))
+
+        cache_key = CACHE.key({**params, "format": fmt})
+        cached = CACHE.get(cache_key)
+        if cached is not None:
+            return finalize(event, {**cached, "headers": {**cached["headers"], **CACHE.headers(hit=True)}})
+
         location_name = params.get('location_name')
 
-        logger.info(f"Received: date={date}, location_name={location_name}")
+        try:
+            dates = parse_dates(params, MAX_DATES)
+            limit = parse_limit(params.get('limit'), MAX_LIMIT)
+            start_key = decode_cursor(params.get('cursor'))
+            aggregation = parse_aggregation(params)
+            source = str(params.get('source') or "ddb").strip().lower()
+            if source not in SOURCES:
+                raise ValueError(f"source inconnue : {source} (attendu : {', '.join(SOURCES)})")
+            if source == "lake":
+                # Curseur du lac : simple décalage dans le résultat trié
+                offset = (start_key or {}).get("__offset__", 0)
+                if start_key and (set(start_key) != {"__offset__"} or not isinstance(offset, int) or offset < 0):
+                    raise ValueError("Curseur incompatible avec source=lake")
+            else:
+                check_cursor(start_key, dates)
+        except ValueError as e:
+            return error(400, str(e))
 
-        # Lecture brute de la table
-        response = table.scan()
-        items = response.get('Items', [])
-        total_before = len(items)
+        logger.info(f"Received: dates={dates}, location_name={location_name}")
 
-        # Filtrage Python basé sur ton schéma
-        if date:
-            items = [i for i in items if equals(i.get('Date'), date)]
-        if location_name:
-            items = [i for i in items if equals(i.get('Location_Name'), location_name)]
+        filters = {"Location_Name": location_name}
+        if source == "lake":
+            # Import local : duckdb n'est chargé que pour cette source
+            from lake_query import bike_daily
 
-        items_native = decimal_to_native(items)
-        total_after = len(items_native)
+            lake_dates = [d for d in dates if d]
+            last_key = None
+            if aggregation:
+                items = bike_daily(lake_dates, location_name, fields=aggregation_fields(aggregation)).to_pylist()
+                scanned = len(items)
+                items = aggregate_items(items, aggregation)
+            else:
+                # Une ligne de plus que la page : indique s'il reste une suite
+                page_limit = limit + 1 if limit else None
+                items = bike_daily(lake_dates, location_name, fields=parse_fields(params.get('fields')),
+                                   limit=page_limit, offset=offset).to_pylist()
+                scanned = len(items)
+                if limit and len(items) > limit:
+                    items = items[:limit]
+                    last_key = {"__offset__": offset + limit}
+            stats = {"access_path": "lake:bike_gold", "scanned_count": scanned, "returned_count": len(items),
+                     "last_key": last_key}
+        elif aggregation:
+            # Mode agrégation : lecture projetée sur les agrégats journaliers, réduction côté serveur
+            items, stats = query_dates(table, filters, "Date", dates, INDEXES, fields=aggregation_fields(aggregation))
+            items = aggregate_items(items, aggregation)
+        else:
+            # Query sur la clé / le GSI adapté (scan parallèle si aucun index ne s'applique)
+            items, stats = query_dates(
+                table, filters, "Date", dates, INDEXES,
+                fields=parse_fields(params.get('fields')), limit=limit, start_key=start_key,
+            )
 
-        debug = {
-            "received_params": params,
-            "total_items_in_table": total_before,
-            "total_after_filter": total_after,
-            "sample_items": items_native[:3]
-        }
+        next_cursor = encode_cursor(stats["last_key"])
 
-        logger.info(json.dumps(debug, ensure_ascii=False))
+        if fmt != "json":
+            # Formats colonnaires : curseur et nombre de lignes passent en en-têtes
+            body, is_binary = encode_items(items, fmt)
+            headers = {"Content-Type": FORMATS[fmt], "X-Count": str(len(items))}
+            if next_cursor:
+                headers["X-Next-Cursor"] = next_cursor
+            response = {"statusCode": 200, "headers": headers, "body": body, "isBase64Encoded": is_binary}
+        else:
+            payload = {
+                "items": items,
+                "count": len(items),
+                "next_cursor": next_cursor,
+            }
 
-        return {
-            "statusCode": 200,
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps({"debug": debug, "items": items_native}, ensure_ascii=False)
-        }
+            # Bloc debug uniquement sur demande explicite (?debug=1)
+            if is_truthy(params.get('debug')):
+                payload["debug"] = {
+                    "received_params": params,
+                    "access_path": stats["access_path"],
+                    "scanned_count": stats["scanned_count"],
+                    "total_after_filter": len(items),
+                    "sample_items": items[:3]
+                }
+                logger.info(json.dumps(payload["debug"], ensure_ascii=False, default=json_default))
+
+            response = {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(payload, ensure_ascii=False, default=json_default)
+            }
+
+        CACHE.put(cache_key, response, len(response["body"]), CACHE.ttl_for(dates))
+        return finalize(event, {**response, "headers": {**response["headers"], **CACHE.headers(hit=False)}})
 
     except Exception as e:
         logger.exception("Erreur Lambda vélo")
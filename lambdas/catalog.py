@@ -0,0 +1,63 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# ----------------------------
+# CONFIGURATION
+# ----------------------------
+CATALOG_PREFIX = os.environ.get("CATALOG_PREFIX", "catalog/")
+MAX_WORKERS = 16  # Lectures S3 simultanées des entrées
+
+
+def entry_key(dataset, day):
+    """Une entrée par (jeu de données, jour) : catalog/<dataset>/date=<jour>.json."""
+    return f"{CATALOG_PREFIX}{dataset}/date={day}.json"
+
+
+def _put(s3, bucket, entry):
+    s3.put_object(
+        Bucket=bucket,
+        Key=entry_key(entry["dataset"], entry["day"]),
+        Body=json.dumps(entry, ensure_ascii=False).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def _get(s3, bucket, key):
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+
+
+def write_entry(s3, bucket, dataset, day, rows, **extra):
+    """Écrit (ou remplace) l'entrée d'un jour avec son nombre de lignes et sa date de mise à jour."""
+    entry = {
+        **extra,
+        "dataset": dataset,
+        "day": str(day),
+        "rows": int(rows),
+        "updated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    _put(s3, bucket, entry)
+    return entry
+
+
+def touch_entry(s3, bucket, dataset, day, **extra):
+    """Signale qu'un jour a reçu des données sans connaître le total : garde ``rows`` existant."""
+    entry = _get(s3, bucket, entry_key(dataset, day)) or {}
+    kept = {k: v for k, v in entry.items() if k not in ("dataset", "day", "rows", "updated_at")}
+    return write_entry(s3, bucket, dataset, day, entry.get("rows", 0), **{**kept, **extra, "pending": True})
+
+
+def read_catalog(s3, bucket, dataset, max_workers=MAX_WORKERS):
+    """Toutes les entrées d'un jeu de données, du jour le plus récent au plus ancien."""
+    keys = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=f"{CATALOG_PREFIX}{dataset}/"):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []) if obj["Key"].endswith(".json"))
+    if not keys:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as pool:
+        entries = [e for e in pool.map(lambda key: _get(s3, bucket, key), keys) if e]
+    return sorted(entries, key=lambda e: e["day"], reverse=True)
@@ -1,57 +1,137 @@
+import hashlib
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from urllib.parse import unquote_plus
 
 import boto3
 import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
 
+from catalog import touch_entry
+
 S3 = boto3.client("s3")
 LMB = boto3.client("lambda")
 
 BUCKET = os.environ.get("BUCKET", "cityflow-raw0")
 AGG_FN = os.environ.get("AGGREGATE_FUNCTION_NAME", "cityflow-aggregate")
 SILVER_PREFIX = os.environ.get("SILVER_PREFIX", "silver/")
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 8))
 
 REQUIRED_COLS = {"Date", "Counts", "Location_Name"}
-
-def _split_coords(s: str):
-    if pd.isna(s) or not str(s).strip():
-        return None, None
-    parts = str(s).split(",")
-    if len(parts) != 2:
-        return None, None
-    try:
-        return float(parts[0]), float(parts[1])
-    except Exception:
-        return None, None
-
-def lambda_handler(event, context):
-    # ---- 1) Get S3 object from event ----
-    record = event["Records"][0]
-    bucket = record["s3"]["bucket"]["name"]
-    key = record["s3"]["object"]["key"]
-    print(f"[CLEAN] Input: s3://{bucket}/{key}")
-
-    # ---- 2) Read CSV ----
+# Text columns of the ingestion delta schema: CSV deltas must not infer them as numbers
+TEXT_COLS = ["ISO_Date", "Status", "Sensor_ID", "Location_Name", "Coordinates", "Direction"]
+
+def _split_coords(coords: pd.Series):
+    """Split "lat,lon" strings into two float columns (NaN when malformed), vectorized."""
+    parts = coords.astype("string").str.extract(r"^\s*([^,]+?)\s*,\s*([^,]+?)\s*$")
+    lat = pd.to_numeric(parts[0], errors="coerce")
+    lon = pd.to_numeric(parts[1], errors="coerce")
+    ok = lat.notna() & lon.notna()
+    return lat.where(ok).astype("float64"), lon.where(ok).astype("float64")
+
+def _read_delta(body: bytes, key: str):
+    """Read a raw delta (Parquet, gzip CSV or CSV) based on its key extension"""
+    if key.endswith(".parquet"):
+        return pq.read_table(BytesIO(body)).to_pandas()
+    compression = "gzip" if key.endswith(".gz") else None
+    return pd.read_csv(BytesIO(body), compression=compression, dtype={c: str for c in TEXT_COLS})
+
+def _s3_records(event):
+    """Yield (item_id, bucket, key) for every S3 object in a direct S3 or SQS-wrapped event.
+
+    item_id is the SQS messageId (used for batchItemFailures) or the object key for direct
+    S3 notifications. A message that carries several S3 records shares its messageId.
+    """
+    for record in event.get("Records", []):
+        if record.get("eventSource") == "aws:sqs":
+            item_id = record["messageId"]
+            try:
+                body = json.loads(record["body"])
+            except (TypeError, ValueError):
+                print(f"[CLEAN] Unreadable SQS body in message {item_id}")
+                yield item_id, None, None
+                continue
+            # s3:TestEvent and other non-object messages carry no Records
+            for inner in body.get("Records", []):
+                yield item_id, inner["s3"]["bucket"]["name"], unquote_plus(inner["s3"]["object"]["key"])
+        else:
+            key = unquote_plus(record["s3"]["object"]["key"])
+            yield key, record["s3"]["bucket"]["name"], key
+
+def _part_key(day, source):
+    """Silver key derived from the source object (key + ETag) and the day.
+
+    A redelivered S3/SQS event rewrites the very same part instead of adding a new one,
+    so aggregate_bike never counts a delta twice.
+    """
+    digest = hashlib.blake2b(f"{source}|{day}".encode("utf-8"), digest_size=16).hexdigest()
+    return f"{SILVER_PREFIX}date={day}/part-{digest}.parquet"
+
+def _fetch(bucket, key):
+    """Download and parse one raw delta; raises on unreadable or invalid input.
+
+    Dtypes are normalized per delta so Parquet and CSV deltas concatenate into a single
+    writable frame (timestamps in UTC, numeric counts, text identifiers). Rows are tagged
+    with their source object, which names the silver parts they end up in.
+    """
     obj = S3.get_object(Bucket=bucket, Key=key)
-    df = pd.read_csv(obj["Body"])
-
-    # ---- 3) Validate & clean ----
+    df = _read_delta(obj["Body"].read(), key)
     missing = REQUIRED_COLS - set(df.columns)
     if missing:
         raise ValueError(f"Missing required columns: {missing}")
-
-    df["Counts"] = pd.to_numeric(df["Counts"], errors="coerce")
+    df["Counts"] = pd.to_numeric(df["Counts"], errors="coerce").astype("float64")
     df["Date"] = pd.to_datetime(df["Date"], errors="coerce", utc=True)
+    for col in TEXT_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype(str).where(df[col].notna())
+    df["_source"] = f"s3://{bucket}/{key}@{obj.get('ETag', '')}"
+    return df
 
+def lambda_handler(event, context):
+    # ---- 1) Collect every S3 object in the event (direct or via SQS) ----
+    targets, failed = [], set()
+    for item_id, bucket, key in _s3_records(event):
+        if key is None:
+            failed.add(item_id)
+        elif key.rsplit("/", 1)[-1].startswith("_"):
+            print(f"[CLEAN] Skipping metadata object {key}")
+        else:
+            targets.append((item_id, bucket, key))
+    print(f"[CLEAN] {len(targets)} object(s) to clean")
+
+    # ---- 2) Read deltas concurrently (Parquet / CSV gzip / CSV) ----
+    frames = []
+    if targets:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(targets))) as pool:
+            futures = [(t, pool.submit(_fetch, t[1], t[2])) for t in targets]
+            for (item_id, bucket, key), future in futures:
+                try:
+                    frames.append((item_id, future.result()))
+                    print(f"[CLEAN] Input: s3://{bucket}/{key}")
+                except Exception as e:
+                    print(f"[CLEAN] Failed to read s3://{bucket}/{key}: {e}")
+                    failed.add(item_id)
+
+    # Direct S3 invocations have no partial retry: fail the whole event so Lambda retries it
+    from_sqs = any(r.get("eventSource") == "aws:sqs" for r in event.get("Records", []))
+    if failed and not from_sqs:
+        raise RuntimeError(f"Failed to read {len(failed)} object(s): {sorted(failed)}")
+
+    # A message is only acknowledged if all of its objects were read
+    frames = [df for item_id, df in frames if item_id not in failed]
+    failures = [{"itemIdentifier": item_id} for item_id in sorted(failed)]
+    if not frames:
+        return {"ok": not failed, "partitions": [], "batchItemFailures": failures}
+
+    # ---- 3) Clean the combined batch ----
+    df = pd.concat(frames, ignore_index=True)
     df = df.dropna(subset=["Counts", "Date", "Location_Name"])
 
     if "Coordinates" in df.columns:
-        latlon = df["Coordinates"].apply(_split_coords)
-        df["Latitude"] = [xy[0] for xy in latlon]
-        df["Longitude"] = [xy[1] for xy in latlon]
+        df["Latitude"], df["Longitude"] = _split_coords(df["Coordinates"])
 
     # prune optional/noisy cols if present
     for col in ["isodate", "Status", "counter", "Coordinates"]:
@@ -60,21 +140,35 @@ def lambda_handler(event, context):
 
     df["day"] = df["Date"].dt.strftime("%Y-%m-%d")
 
-    # ---- 4) Write Silver (Parquet partitioned by day) ----
-    day = df["day"].iloc[0]
-    silver_key = f"{SILVER_PREFIX}date={day}/clean.parquet"  # unique by day (overwrite ok)
-    buf = BytesIO()
-    pq.write_table(pa.Table.from_pandas(df), buf)
-    S3.put_object(Bucket=BUCKET, Key=silver_key, Body=buf.getvalue())
-    print(f"[CLEAN] Wrote: s3://{BUCKET}/{silver_key}")
-
-    # ---- 5) Trigger aggregate (async) ----
-    payload = {"silver_key": silver_key, "day": day}
-    LMB.invoke(
-        FunctionName=AGG_FN,
-        InvocationType="Event",
-        Payload=json.dumps(payload).encode("utf-8"),
-    )
-    print(f"[CLEAN] Invoked {AGG_FN} for day={day}")
-
-    return {"ok": True, "silver_key": silver_key, "day": day}
+    # ---- 4) Write Silver (append-only: one part per source object and day) ----
+    # Every part is encoded before the first upload: a bad batch fails without partial writes
+    encoded = []
+    for (day, source), part in df.groupby(["day", "_source"], sort=True):
+        buf = BytesIO()
+        pq.write_table(pa.Table.from_pandas(part.drop(columns=["_source"]), preserve_index=False), buf)
+        encoded.append((day, _part_key(day, source), part, buf.getvalue()))
+
+    partitions = []
+    for day, silver_key, part, body in encoded:
+        S3.put_object(Bucket=BUCKET, Key=silver_key, Body=body)
+        print(f"[CLEAN] Wrote: s3://{BUCKET}/{silver_key} ({len(part)} rows)")
+        partitions.append({"silver_key": silver_key, "day": day, "rows": len(part)})
+
+    if not partitions:
+        print("[CLEAN] No valid rows after cleaning")
+
+    # ---- 5) Trigger aggregate (async), once per affected day ----
+    days = {}
+    for p in partitions:
+        days.setdefault(p["day"], []).append(p["silver_key"])
+    for day, silver_keys in days.items():
+        touch_entry(S3, BUCKET, "bike", day)  # day visible in the catalog right away
+        payload = {"silver_keys": silver_keys, "day": day}
+        LMB.invoke(
+            FunctionName=AGG_FN,
+            InvocationType="Event",
+            Payload=json.dumps(payload).encode("utf-8"),
+        )
+        print(f"[CLEAN] Invoked {AGG_FN} for day={day}")
+
+    return {"ok": not failed, "partitions": partitions, "batchItemFailures": failures}
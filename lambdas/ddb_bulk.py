@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import boto3
+import numpy as np
+
+logger = logging.getLogger()
+
+# ----------------------------
+# CONFIGURATION
+# ----------------------------
+BATCH_SIZE = 25          # Limite de BatchWriteItem
+MAX_WORKERS = 4          # Threads d'écriture en parallèle
+MAX_RETRIES = 8          # Tentatives pour les UnprocessedItems
+BASE_BACKOFF_S = 0.05
+
+
+# ----------------------------
+# CONSTRUCTION DES ITEMS
+# ----------------------------
+
+def _column_values(values):
+    """Convertit une colonne en valeurs acceptées par DynamoDB (None = attribut absent)."""
+    arr = np.asarray(values)
+    if arr.dtype.kind == "f":
+        nan = np.isnan(arr).tolist()
+        return [None if is_nan else Decimal(repr(v)) for v, is_nan in zip(arr.tolist(), nan)]
+    if arr.dtype.kind in "iub":
+        return arr.tolist()
+    out = []
+    for v in arr.tolist():
+        if v is None or (isinstance(v, float) and v != v):
+            out.append(None)
+        elif isinstance(v, float):
+            out.append(Decimal(repr(v)))
+        elif isinstance(v, (str, int, bool, Decimal)):
+            out.append(v)
+        else:
+            out.append(str(v))
+    return out
+
+
+def items_from_columns(columns):
+    """Construit les items à partir de colonnes (nom -> tableau), sans itération pandas ligne à ligne."""
+    names = list(columns)
+    converted = [_column_values(columns[name]) for name in names]
+    return [
+        {name: value for name, value in zip(names, row) if value is not None}
+        for row in zip(*converted)
+    ]
+
+
+def item_digest(item):
+    """Empreinte stable du contenu d'un item."""
+    payload = json.dumps(item, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=12).hexdigest()
+
+
+class DigestStore:
+    """Empreintes des derniers items écrits, conservées dans un petit objet JSON sur S3."""
+
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+
+    def load(self):
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=self.key)["Body"].read()
+        except self.s3.exceptions.NoSuchKey:
+            return {}
+        return json.loads(body)
+
+    def save(self, digests):
+        self.s3.put_object(Bucket=self.bucket, Key=self.key,
+                           Body=json.dumps(digests).encode("utf-8"),
+                           ContentType="application/json")
+
+
+# ----------------------------
+# ÉCRITURE
+# ----------------------------
+
+def _write_slice(table_name, items, region):
+    """Écrit une tranche d'items par lots de 25, en rejouant les UnprocessedItems avec backoff."""
+    # Une session par thread : les ressources boto3 ne sont pas thread-safe
+    resource = boto3.session.Session().resource("dynamodb", region_name=region)
+    calls = 0
+    for start in range(0, len(items), BATCH_SIZE):
+        requests = [{"PutRequest": {"Item": item}} for item in items[start:start + BATCH_SIZE]]
+        for attempt in range(MAX_RETRIES + 1):
+            response = resource.batch_write_item(RequestItems={table_name: requests})
+            calls += 1
+            requests = response.get("UnprocessedItems", {}).get(table_name, [])
+            if not requests:
+                break
+            if attempt == MAX_RETRIES:
+                raise RuntimeError(f"{len(requests)} items non écrits dans {table_name} après {MAX_RETRIES} essais")
+            time.sleep(random.uniform(0, BASE_BACKOFF_S * 2 ** attempt))
+    return calls
+
+
+def bulk_put(table_name, items, key_attrs, region=None, max_workers=MAX_WORKERS, digests=None):
+    """Écrit les items en parallèle dans la table ; renvoie des statistiques d'écriture.
+
+    Si ``digests`` (clé primaire -> empreinte) est fourni, les items dont le contenu n'a pas
+    changé depuis la dernière écriture sont ignorés et le dictionnaire est mis à jour.
+    """
+    # Dernier item gagnant par clé : BatchWriteItem refuse les doublons dans un même lot
+    by_key = {"|".join(str(item[k]) for k in key_attrs): item for item in items}
+
+    to_write = []
+    for pkey, item in by_key.items():
+        if digests is not None:
+            digest = item_digest(item)
+            if digests.get(pkey) == digest:
+                continue
+            digests[pkey] = digest
+        to_write.append(item)
+
+    skipped = len(by_key) - len(to_write)
+    if not to_write:
+        logger.info(f"{table_name} : aucun item modifié ({skipped} ignorés).")
+        return {"written": 0, "skipped": skipped, "calls": 0}
+
+    workers = max(1, min(max_workers, -(-len(to_write) // BATCH_SIZE)))
+    slice_size = -(-len(to_write) // workers)
+    slices = [to_write[i:i + slice_size] for i in range(0, len(to_write), slice_size)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        calls = sum(pool.map(lambda part: _write_slice(table_name, part, region), slices))
+    elapsed = time.perf_counter() - started
+
+    logger.info(f"{table_name} : {len(to_write)} items écrits, {skipped} inchangés ignorés, "
+                f"{calls} appels BatchWriteItem en {elapsed:.2f}s ({workers} threads).")
+    return {"written": len(to_write), "skipped": skipped, "calls": calls}
@@ -0,0 +1,187 @@
+import base64
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import reduce
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+
+logger = logging.getLogger()
+
+SCAN_SEGMENTS = 4  # Segments du scan parallèle de repli
+
+
+def encode_cursor(last_key):
+    """Encode un LastEvaluatedKey en curseur opaque (base64 url-safe)."""
+    if not last_key:
+        return None
+    raw = json.dumps(last_key, default=lambda d: {"__decimal__": str(d)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Inverse d'encode_cursor ; ValueError si le curseur est invalide."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii"))
+        return json.loads(raw, object_hook=lambda o: Decimal(o["__decimal__"]) if "__decimal__" in o else o)
+    except Exception as e:
+        raise ValueError(f"Curseur invalide : {cursor}") from e
+
+
+def projection_kwargs(fields):
+    """Traduit une liste de champs en ProjectionExpression (noms échappés)."""
+    if not fields:
+        return {}
+    names = {f"#p{i}": field for i, field in enumerate(fields)}
+    return {"ProjectionExpression": ", ".join(names), "ExpressionAttributeNames": names}
+
+
+def _pick_index(filters, indexes):
+    """Choisit l'index dont la clé de partition est filtrée (clé de tri filtrée en bonus)."""
+    best = None
+    for index in indexes:
+        if index["pk"] not in filters:
+            continue
+        if index.get("sk") and index["sk"] in filters:
+            return index
+        best = best or index
+    return best
+
+
+def _and(conditions):
+    return reduce(lambda a, b: a & b, conditions) if conditions else None
+
+
+def _paginate(call, kwargs, limit=None):
+    """Enchaîne les pages ; avec ``limit``, s'arrête à ``limit`` items et renvoie la clé de reprise."""
+    items, scanned = [], 0
+    while True:
+        if limit is not None:
+            kwargs["Limit"] = limit - len(items)
+        response = call(**kwargs)
+        items.extend(response.get("Items", []))
+        scanned += response.get("ScannedCount", 0)
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key or (limit is not None and len(items) >= limit):
+            return items, scanned, last_key
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def _scan_segment(table_name, region, kwargs, segment, total_segments):
+    # Une ressource par thread : les ressources boto3 ne sont pas thread-safe
+    table = boto3.session.Session().resource("dynamodb", region_name=region).Table(table_name)
+    kwargs = dict(kwargs, Segment=segment, TotalSegments=total_segments)
+    if "ExpressionAttributeNames" in kwargs:
+        # boto3 complète ce dict avec ses propres placeholders : une copie par thread
+        kwargs["ExpressionAttributeNames"] = dict(kwargs["ExpressionAttributeNames"])
+    items, scanned, _ = _paginate(table.scan, kwargs)
+    return items, scanned
+
+
+def query_items(table, filters, indexes, segments=SCAN_SEGMENTS, fields=None, limit=None, start_key=None):
+    """Items correspondant aux filtres d'égalité, via Query sur un index si possible, sinon Scan ; renvoie (items, stats)."""
+    filters = {attr: str(value).strip() for attr, value in filters.items() if value}
+    index = _pick_index(filters, indexes)
+
+    key_attrs = []
+    if index:
+        key_attrs = [index["pk"]] + ([index["sk"]] if index.get("sk") in filters else [])
+    filter_expr = _and([Attr(attr).eq(value) for attr, value in filters.items() if attr not in key_attrs])
+
+    kwargs = projection_kwargs(fields)
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+    if filter_expr is not None:
+        kwargs["FilterExpression"] = filter_expr
+
+    if index:
+        kwargs["KeyConditionExpression"] = _and([Key(attr).eq(filters[attr]) for attr in key_attrs])
+        if index.get("name"):
+            kwargs["IndexName"] = index["name"]
+        items, scanned, last_key = _paginate(table.query, kwargs, limit)
+        access = f"query:{index.get('name') or 'table'}"
+    elif limit is not None or start_key:
+        # Un ExclusiveStartKey n'appartient qu'à un segment : reprise séquentielle, jamais segmentée
+        items, scanned, last_key = _paginate(table.scan, kwargs, limit)
+        access = "scan:paged"
+    else:
+        region = table.meta.client.meta.region_name
+        with ThreadPoolExecutor(max_workers=segments) as pool:
+            results = list(pool.map(
+                lambda seg: _scan_segment(table.name, region, kwargs, seg, segments), range(segments)
+            ))
+        items = [item for seg_items, _ in results for item in seg_items]
+        scanned = sum(seg_scanned for _, seg_scanned in results)
+        last_key = None
+        access = f"scan:{segments}_segments"
+
+    logger.info(f"{table.name} : {access}, {scanned} items lus, {len(items)} renvoyés")
+    return items, {"access_path": access, "scanned_count": scanned, "returned_count": len(items),
+                   "last_key": last_key}
+
+
+def check_cursor(start_key, dates):
+    """ValueError si le curseur ne correspond pas aux dates demandées (simple ou composite)."""
+    if not start_key:
+        return
+    composite = "__date__" in start_key
+    if "__offset__" in start_key or composite != (len(dates) > 1) or (composite and start_key["__date__"] not in dates):
+        raise ValueError("Curseur incompatible avec les dates demandées")
+
+
+def _table_copy(table):
+    # Une ressource par thread : les ressources boto3 ne sont pas thread-safe
+    region = table.meta.client.meta.region_name
+    return boto3.session.Session().resource("dynamodb", region_name=region).Table(table.name)
+
+
+def query_dates(table, filters, date_attr, dates, indexes, fields=None, limit=None, start_key=None):
+    """query_items sur plusieurs dates : une requête (Query sur l'index de date) par jour.
+
+    Sans ``limit``, les jours sont interrogés en parallèle. Avec ``limit``, ils sont parcourus
+    dans l'ordre et ``stats["last_key"]`` devient un curseur composite {"__date__", "__key__"}
+    qui reprend au bon jour. Une seule date : strictement équivalent à query_items.
+    """
+    if len(dates) <= 1:
+        return query_items(table, {**filters, date_attr: dates[0] if dates else None}, indexes,
+                           fields=fields, limit=limit, start_key=start_key)
+
+    if limit is None:
+        with ThreadPoolExecutor(max_workers=min(len(dates), SCAN_SEGMENTS * 2)) as pool:
+            results = list(pool.map(
+                lambda d: query_items(_table_copy(table), {**filters, date_attr: d}, indexes, fields=fields),
+                dates,
+            ))
+        items = [item for day_items, _ in results for item in day_items]
+        return items, {
+            "access_path": ",".join(sorted({s["access_path"] for _, s in results})),
+            "scanned_count": sum(s["scanned_count"] for _, s in results),
+            "returned_count": len(items),
+            "last_key": None,
+        }
+
+    start_key = start_key or {}
+    position = dates.index(start_key["__date__"]) if start_key else 0
+    key = start_key.get("__key__")
+
+    items, scanned, paths, last_key = [], 0, set(), None
+    for i in range(position, len(dates)):
+        day_items, stats = query_items(table, {**filters, date_attr: dates[i]}, indexes,
+                                       fields=fields, limit=limit - len(items), start_key=key)
+        items.extend(day_items)
+        scanned += stats["scanned_count"]
+        paths.add(stats["access_path"])
+        key = None
+        if stats["last_key"]:
+            last_key = {"__date__": dates[i], "__key__": stats["last_key"]}
+            break
+        if len(items) >= limit:
+            if i + 1 < len(dates):
+                last_key = {"__date__": dates[i + 1], "__key__": None}
+            break
+    return items, {"access_path": ",".join(sorted(paths)), "scanned_count": scanned,
+                   "returned_count": len(items), "last_key": last_key}
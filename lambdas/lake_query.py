@@ -0,0 +1,171 @@
+import argparse
+import logging
+import os
+import threading
+
+logger = logging.getLogger()
+
+# ----------------------------
+# CONFIGURATION
+# ----------------------------
+# Racine du lac : dossier local (tests, dashboard) ou bucket S3 (lambdas), ex. s3://cityflow-raw0
+LAKE_ROOT = os.environ.get("LAKE_ROOT", "s3://cityflow-raw0")
+LAKE_REGION = os.environ.get("LAKE_REGION", os.environ.get("AWS_REGION", "eu-west-3"))
+LAKE_THREADS = int(os.environ.get("LAKE_THREADS", 4))
+
+# Vues exposées -> (motif relatif à la racine, partitionnement date=<jour>) :
+# "hive" = colonne date élaguée par DuckDB ; autre texte = partition exposée sous ce nom, quand les
+# fichiers ont leur propre colonne Date (identifiants insensibles à la casse : date l'écraserait)
+VIEWS = {
+    "bike_silver": ("silver/date=*/*.parquet", "part_date"),
+    "bike_gold": ("gold/date=*/*.parquet", "hive"),
+    "bike_rollup": ("rollups/bike/date=*/*.parquet", "hive"),
+    "traffic_state": ("state/etat-trafic/date=*/*.parquet", "hive"),
+    "traffic_raw": ("etat-trafic/*/*/*/*.parquet", None),  # Convention du poller : YYYY/MM/DD/
+}
+
+
+# ----------------------------
+# CONNEXION
+# ----------------------------
+
+def _source(root, pattern, partitioning):
+    path = f"{root.rstrip('/')}/{pattern}"
+    if partitioning == "hive":
+        # Partition en texte (comme les dates des items DynamoDB) : WHERE date = 'AAAA-MM-JJ' élague les dossiers
+        return (f"read_parquet('{path}', hive_partitioning = true, hive_types = {{'date': 'VARCHAR'}}, "
+                f"union_by_name = true)")
+    if partitioning:
+        # Partition lue dans le chemin, sans remplacer la colonne Date des fichiers
+        return (f"(SELECT * EXCLUDE (filename), regexp_extract(filename, 'date=([^/]+)/', 1) AS {partitioning} "
+                f"FROM read_parquet('{path}', hive_partitioning = false, filename = true, union_by_name = true))")
+    return f"read_parquet('{path}', filename = true, union_by_name = true)"
+
+
+def connect(root=LAKE_ROOT):
+    """Connexion DuckDB en mémoire avec une vue par jeu de données présent sous ``root``.
+
+    Les vues ne lisent rien à la création : projection et filtres sur ``date`` sont poussés
+    jusqu'au Parquet (seules les colonnes et partitions utiles sont lues). Un jeu de données
+    sans fichier est simplement ignoré.
+    """
+    # Import local : duckdb n'est requis que pour ce moteur
+    import duckdb
+
+    con = duckdb.connect()
+    con.execute(f"SET threads = {LAKE_THREADS}")
+    if root.startswith("s3://"):
+        con.execute("INSTALL httpfs")
+        con.execute("LOAD httpfs")
+        # Identifiants de la chaîne AWS standard (rôle Lambda, profil local, variables d'env)
+        con.execute(f"CREATE SECRET lake_s3 (TYPE S3, PROVIDER CREDENTIAL_CHAIN, REGION '{LAKE_REGION}')")
+
+    for name, (pattern, partitioning) in VIEWS.items():
+        try:
+            con.execute(f"CREATE VIEW {name} AS SELECT * FROM {_source(root, pattern, partitioning)}")
+        except duckdb.IOException:
+            logger.info(f"Lac : aucune donnée pour la vue {name}")
+    return con
+
+
+_local = threading.local()
+
+
+def _connection(root):
+    """Connexion réutilisée par thread (et entre invocations d'un conteneur Lambda chaud)."""
+    cached = getattr(_local, "connections", None)
+    if cached is None:
+        cached = _local.connections = {}
+    if root not in cached:
+        cached[root] = connect(root)
+    return cached[root]
+
+
+def query(sql, params=None, root=LAKE_ROOT):
+    """Exécute une requête SQL sur les vues du lac et renvoie une table Arrow."""
+    return _connection(root).execute(sql, params or []).fetch_arrow_table()
+
+
+def views(root=LAKE_ROOT):
+    return [row[0] for row in _connection(root).execute(
+        "SELECT view_name FROM duckdb_views() WHERE NOT internal ORDER BY view_name"
+    ).fetchall()]
+
+
+# ----------------------------
+# REQUÊTES PRÊTES À L'EMPLOI
+# ----------------------------
+
+def bike_daily(dates=None, location_name=None, fields=None, limit=None, offset=0, root=LAKE_ROOT):
+    """Agrégats vélo journaliers depuis gold, au format des items de l'API (Location_Name, Date, ...).
+
+    ``dates`` élague les partitions lues ; ``fields`` limite les colonnes lues. ``limit`` et
+    ``offset`` découpent le résultat, trié de façon stable par (date, Location_Name).
+    """
+    columns = {
+        "Location_Name": "Location_Name",
+        "Date": "date",
+        "total_counts": "total_counts",
+        "avg_counts": "avg_counts",
+    }
+    selected = [f for f in (fields or columns) if f in columns] or list(columns)
+    where, params = [], []
+    if dates:
+        where.append(f"date IN ({', '.join('?' for _ in dates)})")
+        params.extend(dates)
+    if location_name:
+        where.append("Location_Name = ?")
+        params.append(location_name)
+    sql = (
+        f"SELECT {', '.join(f'{columns[f]} AS {f}' for f in selected)} FROM bike_gold"
+        + (f" WHERE {' AND '.join(where)}" if where else "")
+        + " ORDER BY date, Location_Name"
+    )
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    if offset:
+        sql += " OFFSET ?"
+        params.append(int(offset))
+    return query(sql, params, root=root)
+
+
+def traffic_raw_day(day, columns=None, root=LAKE_ROOT):
+    """Relevés bruts d'un jour : seul le dossier YYYY/MM/DD/ du poller est lu (élagage par chemin)."""
+    import duckdb
+
+    year, month, dom = str(day)[:10].split("-")
+    path = f"{root.rstrip('/')}/etat-trafic/{year}/{month}/{dom}/*.parquet"
+    select = ", ".join(columns) if columns else "*"
+    try:
+        return query(f"SELECT {select} FROM read_parquet('{path}', union_by_name = true)", root=root)
+    except duckdb.IOException:
+        return None
+
+
+# ----------------------------
+# CLI (exécution locale)
+# ----------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Requêtes SQL DuckDB sur le lac CityFlow (Parquet silver/gold/état)")
+    parser.add_argument("sql", nargs="?", help="Requête SQL (sans argument : liste des vues)")
+    parser.add_argument("--root", default=LAKE_ROOT, help="Racine du lac : dossier local ou s3://bucket")
+    parser.add_argument("--explain", action="store_true", help="Affiche le plan (élagage, projection)")
+    args = parser.parse_args(argv)
+
+    if not args.sql:
+        for name in views(args.root):
+            print(name)
+        return
+    sql = f"EXPLAIN {args.sql}" if args.explain else args.sql
+    table = query(sql, root=args.root)
+    if args.explain:
+        for row in table.to_pylist():
+            print(row.get("explain_value", row))
+    else:
+        print(table.to_pandas().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 import boto3
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import io
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
 import logging
 
+from catalog import write_entry
+from ddb_bulk import DigestStore, bulk_put, items_from_columns
+from s3_reader import day_prefix, read_prefix
+
 # ----------------------------
 # CONFIGURATION
 # ----------------------------
@@ -11,10 +18,14 @@ RAW_BUCKET = "cityflow-raw0"           # Bucket S3 où se trouvent les CSV bruts
 RAW_PREFIX = "etat-trafic"             # Dossier dans S3
 DDB_TABLE = "traffic_metrics"          # Nom de la table DynamoDB
 REGION = "eu-west-3"                   # Région AWS (Paris)
+STATE_PREFIX = "state/etat-trafic"     # État agrégé partiel + checkpoint, par jour
+CATALOG_DATASET = "traffic"            # Entrées catalog/traffic/date=<jour>.json
+INCREMENTAL_MODE = True                # Ne traite que les fichiers postérieurs au checkpoint
+CATCHUP_DAYS = 1                       # Jours précédents repris à chaque run (derniers fichiers avant minuit)
+
+STATE_KEYS = ["date", "hour", "id_rva_troncon_fcd_v1_1"]
 
 s3 = boto3.client("s3", region_name=REGION)
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
-table = dynamodb.Table(DDB_TABLE)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -26,26 +37,14 @@ logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s")
 # ----------------------------
 
 def read_csv_from_s3(bucket, prefix):
-    """Lit tous les CSV du dossier du jour depuis S3 et les concatène."""
-    today = datetime.utcnow().date()
-    path = f"{prefix}/{today.year}/{today.month:02d}/{today.day:02d}/"
-    objs = s3.list_objects_v2(Bucket=bucket, Prefix=path)
+    """Lit tous les fichiers bruts du dossier du jour depuis S3 (listage paginé, lecture parallèle)."""
+    path = day_prefix(prefix, datetime.utcnow().date())
+    table, objects = read_prefix(s3, bucket, path)
 
-    if "Contents" not in objs:
+    if not objects:
         logger.warning(f"Aucun fichier trouvé sur S3 pour aujourd'hui : {path}")
         return pd.DataFrame()
-
-    dfs = []
-    for obj in objs["Contents"]:
-        if obj["Key"].endswith(".csv"):
-            logger.info(f"Lecture de {obj['Key']}")
-            file_obj = s3.get_object(Bucket=bucket, Key=obj["Key"])
-            df = pd.read_csv(io.BytesIO(file_obj["Body"].read()))
-            dfs.append(df)
-
-    if not dfs:
-        return pd.DataFrame()
-    return pd.concat(dfs, ignore_index=True)
+    return table.to_pandas()
 
 
 def clean_and_prepare(df):
@@ -88,11 +87,16 @@ def aggregate_data(df):
             lost_time_s=("lost_time_sec", "sum"),
             vitesse_maxi_kmh=("vitesse_maxi", "max"),
             congested_ratio=("is_congested", "mean"),
+            measurements=("is_congested", "size"),
         )
         .reset_index()
     )
     hourly["is_congested"] = hourly["congested_ratio"] >= 0.5
+    return hourly, daily_from_hourly(hourly)
+
 
+def daily_from_hourly(hourly):
+    """Dérive les agrégats journaliers des agrégats horaires."""
     daily = (
         hourly.groupby(["date", "id_rva_troncon_fcd_v1_1"], dropna=False)
         .agg(
@@ -102,37 +106,159 @@ def aggregate_data(df):
             lost_time_s=("lost_time_s", "sum"),
             vitesse_maxi_kmh=("vitesse_maxi_kmh", "max"),
             congested_ratio=("is_congested", "mean"),
+            measurements=("measurements", "sum"),
         )
         .reset_index()
     )
     daily["is_congested"] = daily["congested_ratio"] >= 0.3
-    return hourly, daily
+    return daily
+
+
+# ----------------------------
+# MODE INCRÉMENTAL (état partiel fusionnable)
+# ----------------------------
+
+def partial_state(df):
+    """Calcule l'état partiel (sommes, comptes, max) par (date, heure, tronçon)."""
+    return (
+        df.groupby(STATE_KEYS, dropna=False)
+        .agg(
+            rows=("is_congested", "size"),
+            vehicles_sum=("vehicleprobemeasurement", "sum"),
+            speed_sum=("averagevehiclespeed", "sum"),
+            speed_n=("averagevehiclespeed", "count"),
+            speed_max=("averagevehiclespeed", "max"),
+            traveltime_sum=("traveltime", "sum"),
+            traveltime_n=("traveltime", "count"),
+            traveltime_max=("traveltime", "max"),
+            lost_time_sum=("lost_time_sec", "sum"),
+            lost_time_max=("lost_time_sec", "max"),
+            vitesse_maxi_max=("vitesse_maxi", "max"),
+            congested_sum=("is_congested", "sum"),
+        )
+        .reset_index()
+    )
+
+
+def merge_state(state, partial):
+    """Fusionne deux états partiels : les sommes et comptes s'additionnent, les max se combinent."""
+    if state is None or state.empty:
+        return partial
+    merged = pd.concat([state, partial], ignore_index=True)
+    aggs = {c: ("max" if c.endswith("_max") else "sum") for c in merged.columns if c not in STATE_KEYS}
+    return merged.groupby(STATE_KEYS, dropna=False).agg(aggs).reset_index()
+
+
+def finalize_state(state):
+    """Produit les agrégats horaires et journaliers à partir de l'état, sans relire les données brutes."""
+    if state is None or state.empty:
+        return pd.DataFrame(), pd.DataFrame()
+
+    hourly = state[STATE_KEYS].copy()
+    hourly["vehicles_total"] = state["vehicles_sum"]
+    hourly["avg_speed_kmh"] = state["speed_sum"] / state["speed_n"].where(state["speed_n"] > 0)
+    hourly["avg_traveltime_s"] = state["traveltime_sum"] / state["traveltime_n"].where(state["traveltime_n"] > 0)
+    hourly["lost_time_s"] = state["lost_time_sum"]
+    hourly["vitesse_maxi_kmh"] = state["vitesse_maxi_max"]
+    hourly["congested_ratio"] = state["congested_sum"] / state["rows"]
+    hourly["is_congested"] = hourly["congested_ratio"] >= 0.5
+    hourly["measurements"] = state["rows"]
+    return hourly, daily_from_hourly(hourly)
+
+
+def state_key(day):
+    return f"{STATE_PREFIX}/date={day.isoformat()}/hourly_state.parquet"
+
+
+def load_state(day):
+    """Charge l'état du jour et son checkpoint (stocké dans les métadonnées du Parquet)."""
+    try:
+        body = s3.get_object(Bucket=RAW_BUCKET, Key=state_key(day))["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return None, {}
+    state_table = pq.read_table(io.BytesIO(body))
+    metadata = state_table.schema.metadata or {}
+    checkpoint = json.loads(metadata.get(b"checkpoint", b"{}"))
+    return state_table.to_pandas(), checkpoint
+
+
+def save_state(day, state, checkpoint):
+    """Écrit état + checkpoint en un seul objet : les deux avancent ensemble ou pas du tout."""
+    state_table = pa.Table.from_pandas(state, preserve_index=False)
+    metadata = dict(state_table.schema.metadata or {})
+    metadata[b"checkpoint"] = json.dumps(checkpoint).encode("utf-8")
+    buf = io.BytesIO()
+    pq.write_table(state_table.replace_schema_metadata(metadata), buf)
+    s3.put_object(Bucket=RAW_BUCKET, Key=state_key(day), Body=buf.getvalue())
+
+
+def run_incremental(day):
+    """Fusionne les fichiers postérieurs au checkpoint dans l'état du jour. Renvoie (hourly, daily, nb fichiers)."""
+    state, checkpoint = load_state(day)
+    last_key = checkpoint.get("last_key")
+    logger.info(f"Checkpoint du {day} : {last_key or 'aucun'}")
+
+    table, objects = read_prefix(s3, RAW_BUCKET, day_prefix(RAW_PREFIX, day), start_after=last_key)
+    if not objects:
+        logger.info("Aucun nouveau fichier depuis le dernier checkpoint.")
+        return pd.DataFrame(), pd.DataFrame(), 0
+
+    df = clean_and_prepare(table.to_pandas())
+    if not df.empty:
+        state = merge_state(state, partial_state(df))
+    if state is None:
+        state = pd.DataFrame(columns=STATE_KEYS)
+    save_state(day, state, {
+        "last_key": max(obj["Key"] for obj in objects),
+        "files": checkpoint.get("files", 0) + len(objects),
+        "updated_at": datetime.utcnow().isoformat(),
+    })
+    hourly, daily = finalize_state(state)
+    return hourly, daily, len(objects)
 
 
 def store_in_dynamodb(daily_df):
-    """Stocke les agrégats journaliers dans DynamoDB."""
+    """Stocke les agrégats journaliers dans DynamoDB (écriture parallèle, items inchangés ignorés)."""
     if daily_df.empty:
         logger.info("Aucun agrégat à insérer dans DynamoDB.")
         return
 
-    with table.batch_writer() as batch:
-        for _, row in daily_df.iterrows():
-            item = {
-                "pk": f"TRONCON#{int(row['id_rva_troncon_fcd_v1_1'])}",
-                "sk": f"DATE#{str(row['date'])}",
-                "date": str(row["date"]),
-                "troncon_id": int(row["id_rva_troncon_fcd_v1_1"]),
-                "vehicles_total": float(row["vehicles_total"]),
-                "avg_speed_kmh": float(row["avg_speed_kmh"]),
-                "lost_time_s": float(row["lost_time_s"]),
-                "congested_ratio": float(row["congested_ratio"]),
-                "is_congested": bool(row["is_congested"]),
-            }
-            batch.put_item(Item=item)
-    logger.info(f"{len(daily_df)} agrégats journaliers insérés dans DynamoDB.")
-
-
-if __name__ == "__main__":
+    for day, day_df in daily_df.groupby("date"):
+        troncon_ids = day_df["id_rva_troncon_fcd_v1_1"].astype("int64")
+        dates = day_df["date"].astype(str)
+        items = items_from_columns({
+            "pk": "TRONCON#" + troncon_ids.astype(str),
+            "sk": "DATE#" + dates,
+            "date": dates,
+            "troncon_id": troncon_ids,
+            "vehicles_total": day_df["vehicles_total"].astype(float),
+            "avg_speed_kmh": day_df["avg_speed_kmh"].astype(float),
+            "lost_time_s": day_df["lost_time_s"].astype(float),
+            "congested_ratio": day_df["congested_ratio"].astype(float),
+            "is_congested": day_df["is_congested"].astype(bool),
+        })
+        digest_store = DigestStore(s3, RAW_BUCKET, f"{STATE_PREFIX}/ddb-digests/date={day}.json")
+        digests = digest_store.load()
+        bulk_put(DDB_TABLE, items, key_attrs=["pk", "sk"], region=REGION, digests=digests)
+        digest_store.save(digests)
+        # Jour disponible dans le catalogue : rows = relevés bruts (comme pour le vélo), segments = tronçons
+        write_entry(s3, RAW_BUCKET, CATALOG_DATASET, day, rows=int(day_df["measurements"].sum()), segments=len(day_df))
+    logger.info(f"{len(daily_df)} agrégats journaliers traités pour DynamoDB.")
+
+
+if __name__ == "__main__" and INCREMENTAL_MODE:
+    logger.info("🚀 Lancement du traitement incrémental sur EC2...")
+
+    # Les fichiers écrits après le dernier run d'un jour (≈ 23h-minuit) sont fusionnés au run suivant,
+    # même s'il tombe le lendemain : un jour déjà à jour ne coûte qu'un listage vide
+    today = datetime.utcnow().date()
+    for day in [today - timedelta(days=n) for n in range(CATCHUP_DAYS, -1, -1)]:
+        hourly, daily, n_files = run_incremental(day)
+        if n_files:
+            store_in_dynamodb(daily)
+            logger.info(f"✅ {day} : {n_files} nouveaux fichiers fusionnés, {len(daily)} agrégats insérés.")
+
+elif __name__ == "__main__":
     logger.info("🚀 Lancement du traitement quotidien sur EC2...")
 
     df = read_csv_from_s3(RAW_BUCKET, RAW_PREFIX)
@@ -1,9 +1,11 @@
 import boto3
 import pandas as pd
-import io
 from datetime import datetime
 import logging
 
+from ddb_bulk import bulk_put, items_from_columns
+from s3_reader import day_prefix, read_prefix
+
 # ----------------------------
 # CONFIGURATION
 # ----------------------------
@@ -13,8 +15,6 @@ DDB_TABLE = "traffic_metrics"          # Nom de la table DynamoDB
 REGION = "eu-west-3"                   # Région AWS (Paris)
 
 s3 = boto3.client("s3", region_name=REGION)
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
-table = dynamodb.Table(DDB_TABLE)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -26,26 +26,14 @@ logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s")
 # ----------------------------
 
 def read_csv_from_s3(bucket, prefix):
-    """Lit tous les CSV du dossier du jour depuis S3 et les concatène."""
-    today = datetime.utcnow().date()
-    path = f"{prefix}/{today.year}/{today.month:02d}/{today.day:02d}/"
-    objs = s3.list_objects_v2(Bucket=bucket, Prefix=path)
+    """Lit tous les fichiers bruts du dossier du jour depuis S3 (listage paginé, lecture parallèle)."""
+    path = day_prefix(prefix, datetime.utcnow().date())
+    table, objects = read_prefix(s3, bucket, path)
 
-    if "Contents" not in objs:
+    if not objects:
         logger.warning(f"Aucun fichier trouvé sur S3 pour aujourd'hui : {path}")
         return pd.DataFrame()
-
-    dfs = []
-    for obj in objs["Contents"]:
-        if obj["Key"].endswith(".csv"):
-            logger.info(f"Lecture de {obj['Key']}")
-            file_obj = s3.get_object(Bucket=bucket, Key=obj["Key"])
-            df = pd.read_csv(io.BytesIO(file_obj["Body"].read()))
-            dfs.append(df)
-
-    if not dfs:
-        return pd.DataFrame()
-    return pd.concat(dfs, ignore_index=True)
+    return table.to_pandas()
 
 
 def clean_and_prepare(df):
@@ -110,26 +98,27 @@ def aggregate_data(df):
 
 
 def store_in_dynamodb(daily_df):
-    """Stocke les agrégats journaliers dans DynamoDB."""
+    """Stocke les agrégats journaliers dans DynamoDB (écriture parallèle par lots)."""
     if daily_df.empty:
         logger.info("Aucun agrégat à insérer dans DynamoDB.")
         return
 
-    with table.batch_writer() as batch:
-        for _, row in daily_df.iterrows():
-            item = {
-                "pk": f"TRONCON#{int(row['id_rva_troncon_fcd_v1_1'])}",
-                "sk": f"DATE#{str(row['date'])}",
-                "date": str(row["date"]),
-                "troncon_id": int(row["id_rva_troncon_fcd_v1_1"]),
-                "vehicles_total": float(row["vehicles_total"]),
-                "avg_speed_kmh": float(row["avg_speed_kmh"]),
-                "lost_time_s": float(row["lost_time_s"]),
-                "congested_ratio": float(row["congested_ratio"]),
-                "is_congested": bool(row["is_congested"]),
-            }
-            batch.put_item(Item=item)
-    logger.info(f"{len(daily_df)} agrégats journaliers insérés dans DynamoDB.")
+    for day, day_df in daily_df.groupby("date"):
+        troncon_ids = day_df["id_rva_troncon_fcd_v1_1"].astype("int64")
+        dates = day_df["date"].astype(str)
+        items = items_from_columns({
+            "pk": "TRONCON#" + troncon_ids.astype(str),
+            "sk": "DATE#" + dates,
+            "date": dates,
+            "troncon_id": troncon_ids,
+            "vehicles_total": day_df["vehicles_total"].astype(float),
+            "avg_speed_kmh": day_df["avg_speed_kmh"].astype(float),
+            "lost_time_s": day_df["lost_time_s"].astype(float),
+            "congested_ratio": day_df["congested_ratio"].astype(float),
+            "is_congested": day_df["is_congested"].astype(bool),
+        })
+        bulk_put(DDB_TABLE, items, key_attrs=["pk", "sk"], region=REGION)
+    logger.info(f"{len(daily_df)} agrégats journaliers traités pour DynamoDB.")
 
 
 if __name__ == "__main__":
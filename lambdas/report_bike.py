@@ -1,5 +1,7 @@
 import datetime
+import heapq
 import json
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import boto3
@@ -11,39 +13,109 @@ S3 = boto3.client("s3")
 import os
 BUCKET = os.environ.get("BUCKET", "cityflow-raw0")
 GOLD_PREFIX = os.environ.get("GOLD_PREFIX", "gold/")
+ROLLUP_PREFIX = os.environ.get("ROLLUP_PREFIX", "rollups/bike/")
 REPORTS_PREFIX = os.environ.get("REPORTS_PREFIX", "reports/")
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 8))
+MAX_DAYS = int(os.environ.get("MAX_DAYS", 366))
+TOP_K = 10
 
-def lambda_handler(event, context):
-    day = (datetime.date.today() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-    prefix = f"{GOLD_PREFIX}date={day}/"
-    print(f"[REPORT] day={day} prefix={prefix}")
+PERIOD_DAYS = {"day": 1, "week": 7, "month": 30}
+
+def _date(value):
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def report_range(event):
+    """(start, end) inclusive: explicit start/end, or a rolling period ending yesterday (or at end)."""
+    event = event or {}
+    end = _date(event["end"]) if event.get("end") else datetime.date.today() - datetime.timedelta(days=1)
+    if event.get("start"):
+        start = _date(event["start"])
+    else:
+        period = event.get("period", "day")
+        if period not in PERIOD_DAYS:
+            raise ValueError(f"Unknown period: {period} (expected one of {sorted(PERIOD_DAYS)})")
+        start = end - datetime.timedelta(days=PERIOD_DAYS[period] - 1)
+    if start > end:
+        raise ValueError(f"start {start} is after end {end}")
+    if (end - start).days + 1 > MAX_DAYS:
+        raise ValueError(f"Range too long: {start} -> {end} (max {MAX_DAYS} days)")
+    return start, end
+
+def _read_parquet(key, columns):
+    try:
+        body = S3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+    except S3.exceptions.NoSuchKey:
+        return None
+    return pq.read_table(BytesIO(body), columns=columns).to_pandas()
+
+def read_day(day):
+    """One day's (Location_Name, total_counts, n_counts): the rollup, or gold as a fallback."""
+    df = _read_parquet(f"{ROLLUP_PREFIX}date={day}/rollup.parquet", ["Location_Name", "total_counts", "n_counts"])
+    if df is not None:
+        return df
 
+    # Older days have no rollup: count is recovered from total / average
+    prefix = f"{GOLD_PREFIX}date={day}/"
     resp = S3.list_objects_v2(Bucket=BUCKET, Prefix=prefix)
     keys = [o["Key"] for o in resp.get("Contents", []) if o["Key"].endswith(".parquet")]
-    if not keys:
+    frames = [_read_parquet(k, ["Location_Name", "total_counts", "avg_counts"]) for k in keys]
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        return None
+    gold = pd.concat(frames, ignore_index=True)
+    n = (gold["total_counts"] / gold["avg_counts"]).where(gold["avg_counts"] != 0, 0).round()
+    return gold.assign(n_counts=n)[["Location_Name", "total_counts", "n_counts"]]
+
+def lambda_handler(event, context):
+    start, end = report_range(event)
+    days = [(start + datetime.timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+    print(f"[REPORT] {start} -> {end} ({len(days)} days)")
+
+    # ---- Stream day summaries into running per-location sums ----
+    totals, counts, seen = {}, {}, {}
+    missing = []
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(days))) as pool:
+        for day, df in zip(days, pool.map(read_day, days)):
+            if df is None or df.empty:
+                missing.append(day)
+                continue
+            for loc, total, n in zip(df["Location_Name"].astype(str), df["total_counts"], df["n_counts"]):
+                totals[loc] = totals.get(loc, 0.0) + float(total)
+                counts[loc] = counts.get(loc, 0) + int(n)
+                seen[loc] = seen.get(loc, 0) + 1
+
+    if not totals:
         print("[REPORT] No gold data")
         return {"ok": True, "empty": True}
 
-    dfs = []
-    for k in keys:
-        body = S3.get_object(Bucket=BUCKET, Key=k)["Body"].read()
-        dfs.append(pq.read_table(BytesIO(body)).to_pandas())
-    data = pd.concat(dfs, ignore_index=True)
+    def row(loc):
+        avg = totals[loc] / counts[loc] if counts[loc] else None
+        if len(days) == 1:
+            # Same columns as the gold table for a single day
+            return {"Location_Name": loc, "day": days[0], "total_counts": totals[loc], "avg_counts": avg}
+        return {"Location_Name": loc, "total_counts": totals[loc], "avg_counts": avg, "days": seen[loc]}
 
-    top10 = data.sort_values("total_counts", ascending=False).head(10)
-    congestion = data.sort_values("avg_counts", ascending=False).head(10)
+    # ---- Top-K without sorting every location ----
+    top10 = pd.DataFrame([row(loc) for loc in heapq.nlargest(TOP_K, totals, key=totals.get)])
+    congestion = pd.DataFrame([row(loc) for loc in heapq.nlargest(
+        TOP_K, (loc for loc in totals if counts[loc]), key=lambda loc: totals[loc] / counts[loc]
+    )])
 
-    base = f"{REPORTS_PREFIX}{day}/"
+    label = days[0] if len(days) == 1 else f"{days[0]}_{days[-1]}"
+    base = f"{REPORTS_PREFIX}{label}/"
     S3.put_object(Bucket=BUCKET, Key=base + "top10.csv", Body=top10.to_csv(index=False))
     S3.put_object(Bucket=BUCKET, Key=base + "congestion.csv", Body=congestion.to_csv(index=False))
     S3.put_object(
         Bucket=BUCKET,
         Key=base + "summary.json",
         Body=json.dumps({
-            "day": day,
+            "day": days[0] if len(days) == 1 else None,
+            "start": days[0],
+            "end": days[-1],
+            "days_missing": missing,
             "top10": top10.to_dict(orient="records"),
             "congestion": congestion.to_dict(orient="records")
         }, indent=2, ensure_ascii=False).encode("utf-8")
     )
     print(f"[REPORT] Wrote s3://{BUCKET}/{base}(top10.csv|congestion.csv|summary.json)")
-    return {"ok": True}
+    return {"ok": True, "report_prefix": base, "days_missing": len(missing)}
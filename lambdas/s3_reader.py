@@ -0,0 +1,121 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+logger = logging.getLogger()
+
+# ----------------------------
+# CONFIGURATION
+# ----------------------------
+RAW_EXTENSIONS = (".csv", ".csv.gz", ".parquet")  # Formats écrits par le poller
+MAX_WORKERS = 16                                  # Téléchargements S3 simultanés
+
+
+# ----------------------------
+# LISTAGE / LECTURE
+# ----------------------------
+
+def day_prefix(prefix, day):
+    """Préfixe S3 d'un jour dans la convention du poller : <prefix>/YYYY/MM/DD/."""
+    return f"{prefix}/{day.year}/{day.month:02d}/{day.day:02d}/"
+
+
+def list_objects(s3, bucket, prefix, start_after=None, extensions=RAW_EXTENSIONS):
+    """Liste toutes les clés du préfixe (paginator : pas de limite à 1000 clés)."""
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    if start_after:
+        kwargs["StartAfter"] = start_after
+    objects = []
+    for page in s3.get_paginator("list_objects_v2").paginate(**kwargs):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(extensions):
+                objects.append({"Key": obj["Key"], "Size": obj["Size"]})
+    return objects
+
+
+def read_object_table(s3, bucket, key):
+    """Télécharge un objet et le parse en table Arrow (CSV, CSV gzip ou Parquet)."""
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    if key.endswith(".parquet"):
+        return pq.read_table(pa.BufferReader(body))
+
+    def stream():
+        reader = pa.BufferReader(body)
+        return pa.CompressedInputStream(reader, "gzip") if key.endswith(".gz") else reader
+
+    # Dates et horodatages restent en texte brut, comme dans les Parquet du poller : sinon le
+    # repli en string d'unify_tables mélangerait deux formats et to_datetime perdrait une moitié
+    with pacsv.open_csv(stream()) as reader:
+        temporal = {f.name: pa.string() for f in reader.schema if pa.types.is_temporal(f.type)}
+    return pacsv.read_csv(stream(), convert_options=pacsv.ConvertOptions(column_types=temporal))
+
+
+def _unified_type(types):
+    types = {t for t in types if not pa.types.is_null(t)}
+    if not types:
+        return pa.null()
+    if len(types) == 1:
+        return types.pop()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return pa.string()
+
+
+def unify_tables(tables):
+    """Concatène des tables aux schémas hétérogènes (colonnes manquantes, types inférés différents).
+
+    Un même champ garde son type s'il est unique, passe en float64 s'il mélange entiers et
+    flottants, et en string dans les autres cas.
+    """
+    tables = [t for t in tables if t.num_rows]
+    if not tables:
+        return pa.table({})
+
+    names, types = [], {}
+    for table in tables:
+        for field in table.schema:
+            if field.name not in types:
+                names.append(field.name)
+                types[field.name] = []
+            types[field.name].append(field.type)
+    schema = pa.schema([(name, _unified_type(types[name])) for name in names])
+
+    conformed = []
+    for table in tables:
+        columns = []
+        for field in schema:
+            if field.name in table.column_names:
+                columns.append(table.column(field.name).cast(field.type))
+            else:
+                columns.append(pa.nulls(table.num_rows, type=field.type))
+        conformed.append(pa.Table.from_arrays(columns, schema=schema))
+    return pa.concat_tables(conformed)
+
+
+def read_tables(s3, bucket, objects, max_workers=MAX_WORKERS):
+    """Lit les objets en parallèle (pool borné) et les concatène en une seule table Arrow."""
+    if not objects:
+        return pa.table({})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        tables = list(pool.map(lambda obj: read_object_table(s3, bucket, obj["Key"]), objects))
+    table = unify_tables(tables)
+    elapsed = max(time.perf_counter() - started, 1e-9)
+
+    total_mb = sum(obj["Size"] for obj in objects) / (1024 * 1024)
+    logger.info(
+        f"{len(objects)} fichiers lus ({total_mb:.1f} Mo, {table.num_rows} lignes) en {elapsed:.2f}s : "
+        f"{len(objects) / elapsed:.1f} fichiers/s, {total_mb / elapsed:.2f} Mo/s"
+    )
+    return table
+
+
+def read_prefix(s3, bucket, prefix, start_after=None, max_workers=MAX_WORKERS):
+    """Liste puis lit tous les fichiers bruts d'un préfixe. Renvoie (table, objets lus)."""
+    objects = list_objects(s3, bucket, prefix, start_after=start_after)
+    return read_tables(s3, bucket, objects, max_workers=max_workers), objects
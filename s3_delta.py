@@ -0,0 +1,124 @@
+import gzip
+import io
+import json
+import tempfile
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from boto3.s3.transfer import TransferConfig
+
+
+# Formats de sortie supportés pour les deltas bruts -> extension de fichier
+DELTA_FORMATS = {
+    "parquet": ".parquet",
+    "csv.gz": ".csv.gz",
+    "csv": ".csv",
+}
+
+# Au-delà de ce seuil, le fichier sérialisé passe sur disque et l'upload est multipart
+MULTIPART_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Nombre de lignes sérialisées à la fois (row group Parquet / bloc CSV)
+WRITE_BATCH_ROWS = 100_000
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_CHUNK_BYTES,
+    multipart_chunksize=MULTIPART_CHUNK_BYTES,
+)
+
+
+def delta_extension(fmt: str):
+    """Extension de fichier associée à un format de delta"""
+    if fmt not in DELTA_FORMATS:
+        raise ValueError(f"Format de delta inconnu : {fmt} (attendu : {', '.join(DELTA_FORMATS)})")
+    return DELTA_FORMATS[fmt]
+
+
+def is_delta_key(key: str):
+    """Vrai si la clé porte l'extension d'un des formats de delta"""
+    return key.endswith(tuple(DELTA_FORMATS.values()))
+
+
+def read_delta(body: bytes, key: str, columns=None):
+    """Relit un delta (Parquet, CSV gzip ou CSV) d'après l'extension de sa clé"""
+    if key.endswith(".parquet"):
+        schema_names = pq.read_schema(io.BytesIO(body)).names
+        if columns:
+            columns = [c for c in columns if c in schema_names]
+        return pq.read_table(io.BytesIO(body), columns=columns).to_pandas()
+    compression = "gzip" if key.endswith(".gz") else None
+    usecols = (lambda c: c in columns) if columns else None
+    return pd.read_csv(io.BytesIO(body), compression=compression, usecols=usecols)
+
+
+def _to_arrow(df: pd.DataFrame, schema: pa.Schema = None):
+    """Convertit un bloc en table Arrow en appliquant les types explicites du schéma"""
+    # Champs imbriqués (ex. geo_shape) : sérialisés en JSON pour garder un schéma stable
+    nested = [c for c in df.columns
+              if df[c].dtype == object and df[c].map(lambda v: isinstance(v, (dict, list))).any()]
+    if nested:
+        df = df.copy()
+        for c in nested:
+            df[c] = df[c].map(lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if schema is None:
+        return table
+    for field in schema:
+        idx = table.schema.get_field_index(field.name)
+        if idx >= 0 and table.schema.field(idx).type != field.type:
+            table = table.set_column(idx, field, table.column(idx).cast(field.type))
+    return table
+
+
+def _write_parquet(df, fileobj, schema, compression):
+    writer = None
+    try:
+        for start in range(0, max(len(df), 1), WRITE_BATCH_ROWS):
+            table = _to_arrow(df.iloc[start:start + WRITE_BATCH_ROWS], schema)
+            if writer is None:
+                writer = pq.ParquetWriter(fileobj, table.schema, compression=compression)
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_csv(df, fileobj, compress):
+    raw = gzip.GzipFile(fileobj=fileobj, mode="wb") if compress else fileobj
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    try:
+        for start in range(0, max(len(df), 1), WRITE_BATCH_ROWS):
+            df.iloc[start:start + WRITE_BATCH_ROWS].to_csv(text, index=False, header=start == 0)
+        text.flush()
+    finally:
+        text.detach()
+        if compress:
+            raw.close()
+
+
+def write_delta(df: pd.DataFrame, bucket_name: str, key_base: str, fmt: str = "parquet",
+                schema: pa.Schema = None, compression: str = "zstd", s3=None):
+    """Sérialise un DataFrame par blocs et l'envoie sur S3, renvoie la clé écrite.
+
+    Le fichier est construit dans un SpooledTemporaryFile (sur disque au-delà de
+    MULTIPART_CHUNK_BYTES), puis envoyé via ``upload_fileobj`` en multipart : le
+    buffer sérialisé complet ne réside jamais en mémoire.
+    """
+    key = f"{key_base}{delta_extension(fmt)}"
+    s3 = s3 or boto3.client("s3")
+
+    with tempfile.SpooledTemporaryFile(max_size=MULTIPART_CHUNK_BYTES) as spool:
+        if fmt == "parquet":
+            _write_parquet(df, spool, schema, compression)
+        else:
+            _write_csv(df, spool, compress=fmt == "csv.gz")
+        size = spool.tell()
+        spool.seek(0)
+        s3.upload_fileobj(spool, bucket_name, key, Config=TRANSFER_CONFIG)
+
+    print(f"✅ Fichier envoyé : s3://{bucket_name}/{key} ({fmt}, {size / 1024:.1f} Ko)")
+    return key
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from clean_bike import _split_coords
+
+
+def test_split_coords_parses_lat_lon():
+    lat, lon = _split_coords(pd.Series(["48.1, -1.6", " 48.2 ,-1.7"]))
+    assert lat.tolist() == [48.1, 48.2]
+    assert lon.tolist() == [-1.6, -1.7]
+
+
+def test_split_coords_all_null():
+    lat, lon = _split_coords(pd.Series([np.nan, None], dtype=object))
+    assert lat.isna().all() and lon.isna().all()
+    assert lat.dtype == "float64" and lon.dtype == "float64"
+
+
+def test_split_coords_without_comma():
+    lat, lon = _split_coords(pd.Series(["48.1", "x"]))
+    assert lat.isna().all() and lon.isna().all()
+
+
+def test_split_coords_malformed_values_are_null():
+    coords = pd.Series(["1,2,3", "a,b", ",1", "48.1,-1.6"], index=[10, 11, 12, 13])
+    lat, lon = _split_coords(coords)
+    assert lat.index.tolist() == [10, 11, 12, 13]
+    assert lat.isna().tolist() == [True, True, True, False]
+    assert lon.iloc[-1] == -1.6
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from ingestion_bike import append_to_reference, stream_floor
+
+
+def _wm(day):
+    return {"last_date": pd.Timestamp(day, tz="UTC"), "rows": 1}
+
+
+def test_stream_floor_oldest_watermark():
+    watermarks = {"a": _wm("2025-10-10"), "b": _wm("2025-10-08")}
+    assert stream_floor(watermarks) == pd.Timestamp("2025-10-08", tz="UTC")
+
+
+def test_stream_floor_ignores_dead_sensor(capsys):
+    watermarks = {"a": _wm("2025-10-10"), "dead": _wm("2025-09-02")}
+    assert stream_floor(watermarks, lateness_days=7) == pd.Timestamp("2025-10-03", tz="UTC")
+    assert "dead" in capsys.readouterr().out
+
+
+def test_stream_floor_default_without_watermarks():
+    assert stream_floor({}, default=None) is None
+
+
+def test_append_to_reference_keeps_existing_header(tmp_path):
+    path = tmp_path / "cleaned_data.csv"
+    pd.DataFrame({"Date": ["2025-10-01"], "Sensor_ID": ["a"], "Counts": [1]}).to_csv(path, index=False)
+    delta = pd.DataFrame({"Counts": [2], "Status": ["ok"], "Date": ["2025-10-02"], "Sensor_ID": ["b"]})
+    append_to_reference(delta, path=str(path))
+    df = pd.read_csv(path)
+    assert df.columns.tolist() == ["Date", "Sensor_ID", "Counts"]
+    assert df.iloc[1].tolist() == ["2025-10-02", "b", 2]
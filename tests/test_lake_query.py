@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+import lake_query
+
+pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def lake(tmp_path):
+    for day in ("2025-10-01", "2025-10-02"):
+        silver = tmp_path / "silver" / f"date={day}"
+        silver.mkdir(parents=True)
+        pd.DataFrame({
+            "Date": pd.to_datetime([f"{day}T08:00:00Z", f"{day}T09:00:00Z"], utc=True),
+            "Location_Name": ["A", "B"],
+            "Counts": [1.0, 2.0],
+        }).to_parquet(silver / "part-0.parquet", index=False)
+
+        gold = tmp_path / "gold" / f"date={day}"
+        gold.mkdir(parents=True)
+        pd.DataFrame({
+            "Location_Name": ["A", "B", "C"],
+            "total_counts": [1.0, 2.0, 3.0],
+            "avg_counts": [1.0, 2.0, 3.0],
+        }).to_parquet(gold / "part-0.parquet", index=False)
+    return str(tmp_path)
+
+
+def test_bike_silver_keeps_date_timestamp(lake):
+    con = lake_query._connection(lake)
+    types = {name: dtype for name, dtype, *_ in con.execute("DESCRIBE bike_silver").fetchall()}
+    assert types["Date"].startswith("TIMESTAMP")
+    assert types["part_date"] == "VARCHAR"
+
+    rows = lake_query.query("SELECT DISTINCT part_date FROM bike_silver ORDER BY part_date", root=lake)
+    assert rows.column("part_date").to_pylist() == ["2025-10-01", "2025-10-02"]
+
+
+def test_bike_daily_pages(lake):
+    full = lake_query.bike_daily(root=lake).to_pylist()
+    assert len(full) == 6
+
+    pages, offset = [], 0
+    while True:
+        page = lake_query.bike_daily(limit=4, offset=offset, root=lake).to_pylist()
+        pages.extend(page)
+        if len(page) < 4:
+            break
+        offset += 4
+    assert pages == full
+    assert [(r["Date"], r["Location_Name"]) for r in full[:2]] == [("2025-10-01", "A"), ("2025-10-01", "B")]
+
+
+def test_bike_daily_prunes_dates(lake):
+    rows = lake_query.bike_daily(dates=["2025-10-02"], fields=["Location_Name", "Date"], root=lake).to_pylist()
+    assert {r["Date"] for r in rows} == {"2025-10-02"}
+    assert set(rows[0]) == {"Location_Name", "Date"}
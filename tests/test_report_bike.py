@@ -0,0 +1,45 @@
+import io
+
+import boto3
+import pandas as pd
+import pytest
+from moto import mock_aws
+
+BUCKET = "cityflow-raw0"
+
+
+@pytest.fixture
+def report():
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "eu-west-3"})
+        import report_bike
+
+        report_bike.S3 = s3
+        for day, totals in (("2025-10-01", [10.0, 30.0]), ("2025-10-02", [20.0, 5.0])):
+            buf = io.BytesIO()
+            pd.DataFrame({"Location_Name": ["A", "B"], "total_counts": totals, "n_counts": [2, 3]}).to_parquet(buf, index=False)
+            s3.put_object(Bucket=BUCKET, Key=f"{report_bike.ROLLUP_PREFIX}date={day}/rollup.parquet", Body=buf.getvalue())
+        yield report_bike, s3
+
+
+def _csv(s3, key):
+    return pd.read_csv(io.BytesIO(s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()))
+
+
+def test_single_day_keeps_gold_columns(report):
+    report_bike, s3 = report
+    result = report_bike.lambda_handler({"period": "day", "end": "2025-10-01"}, None)
+    top10 = _csv(s3, result["report_prefix"] + "top10.csv")
+    assert top10.columns.tolist() == ["Location_Name", "day", "total_counts", "avg_counts"]
+    assert top10["Location_Name"].tolist() == ["B", "A"]
+    assert set(top10["day"]) == {"2025-10-01"}
+
+
+def test_multi_day_adds_aggregate_columns(report):
+    report_bike, s3 = report
+    result = report_bike.lambda_handler({"start": "2025-10-01", "end": "2025-10-02"}, None)
+    top10 = _csv(s3, result["report_prefix"] + "top10.csv")
+    assert top10.columns.tolist() == ["Location_Name", "total_counts", "avg_counts", "days"]
+    assert top10.set_index("Location_Name")["total_counts"].to_dict() == {"A": 30.0, "B": 35.0}
+    assert set(top10["days"]) == {2}